@@ -2,28 +2,74 @@
 Call Agent Example - Minh họa cách Call Agent tương tác với Scheduler
 """
 import asyncio
-import json
 import logging
 import time
+from bisect import bisect
+from random import random
 from datetime import datetime
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
 
+import orjson
 import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+try:
+    import uvloop
+except ImportError:  # uvloop không hỗ trợ Windows
+    uvloop = None
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Số call request tối đa lấy trong một lần pop
+BATCH_SIZE = 32
+# Thời gian block tối đa khi queue rỗng (giây); có request mới là trả về ngay
+POP_TIMEOUT = 5
+# Số connection tối đa trong pool Redis dùng chung của agent
+MAX_CONNECTIONS = 8
+# Số worker chạy song song (dùng chung client/pool Redis)
+WORKERS = 4
+# Số cuộc gọi đang xử lý đồng thời tối đa trên toàn agent
+MAX_IN_FLIGHT = 64
+
+# Kết quả giả lập và trọng số cộng dồn: 70% success, 10% no answer, 10% busy, 10% failed
+_OUTCOMES = ("SUCCESS", "NO_ANSWER", "BUSY", "FAILED")
+_CUM_WEIGHTS = (0.7, 0.8, 0.9, 1.0)
+
+
+@lru_cache(maxsize=1024)
+def _callback_prefix(campaign_id: Optional[str], max_attempts: int, retry_interval: int) -> bytes:
+    """Phần JSON cố định theo campaign của callback, dạng b'{"campaignId":...,' để nối với phần còn lại"""
+    return orjson.dumps({
+        "campaignId": campaign_id,
+        "maxAttempts": max_attempts,
+        "retryInterval": retry_interval,
+    })[:-1] + b","
+
+
+def encode_callback(campaign_id: Optional[str], max_attempts: int, retry_interval: int,
+                    fields: Dict[str, Any]) -> bytes:
+    """Encode callback: prefix dựng sẵn theo campaign + các field riêng của cuộc gọi"""
+    return _callback_prefix(campaign_id, max_attempts, retry_interval) + orjson.dumps(fields)[1:]
+
 class CallAgent:
     """Call Agent - Thực hiện cuộc gọi thực tế"""
     
     def __init__(self, redis_url: str):
         self.redis_url = redis_url
         self.redis_client = None
+        # BLMPOP cần Redis >= 7; tự chuyển sang BRPOP nếu server không hỗ trợ
+        self._use_blmpop = True
+        self._sem = asyncio.Semaphore(MAX_IN_FLIGHT)
         
     async def connect(self):
         """Kết nối Redis"""
-        self.redis_client = redis.from_url(self.redis_url, decode_responses=True)
+        pool = redis.BlockingConnectionPool.from_url(
+            self.redis_url, max_connections=MAX_CONNECTIONS, decode_responses=True
+        )
+        self.redis_client = redis.Redis.from_pool(pool)
         logger.info("Connected to Redis")
         
     async def close(self):
@@ -32,21 +78,19 @@ class CallAgent:
             await self.redis_client.aclose()
         logger.info("Disconnected")
         
-    async def start(self):
-        """Bắt đầu Call Agent"""
-        logger.info("🚀 Call Agent started")
+    async def start(self, worker_id: int = 0):
+        """Bắt đầu một worker của Call Agent"""
+        logger.info(f"🚀 Call Agent worker {worker_id} started")
         
         while True:
             try:
                 # Lấy call requests từ Redis queue
                 requests = await self.get_call_requests()
                 
-                for request in requests:
-                    await self.process_call_request(request)
-                    
-                # Nếu không có request, chờ một chút
-                if not requests:
-                    await asyncio.sleep(1)
+                if requests:
+                    results = await asyncio.gather(*(self.process_call_request(r) for r in requests))
+                    # Gom callback của cả batch vào một lệnh LPUSH nhiều giá trị
+                    await self.send_callbacks([cb for cb in results if cb is not None])
                     
             except Exception as e:
                 logger.error(f"Error in Call Agent: {e}")
@@ -55,21 +99,41 @@ class CallAgent:
     async def get_call_requests(self) -> list:
         """Lấy call requests từ Redis queue"""
         try:
-            # Lấy từ Redis queue
-            result = await self.redis_client.brpop("call_requests", timeout=1)
-            if result is None:
-                return []
-                
-            request = json.loads(result[1])
-            logger.info(f"Received call request: {request.get('callId')}")
-            return [request]
+            # Lấy từ Redis queue (tối đa BATCH_SIZE request trong một round-trip)
+            raw_items = await self._pop_call_requests()
+            requests = []
+            for raw in raw_items:
+                request = orjson.loads(raw)
+                logger.info(f"Received call request: {request.get('callId')}")
+                requests.append(request)
+            return requests
             
         except Exception as e:
             logger.error(f"Error getting call requests: {e}")
             return []
             
-    async def process_call_request(self, request: Dict[str, Any]):
-        """Xử lý một call request"""
+    async def _pop_call_requests(self) -> list:
+        """Pop nhiều request cùng lúc bằng BLMPOP, fallback BRPOP cho Redis cũ"""
+        if self._use_blmpop:
+            try:
+                result = await self.redis_client.blmpop(
+                    POP_TIMEOUT, 1, "call_requests", direction="RIGHT", count=BATCH_SIZE
+                )
+                return result[1] if result else []
+            except ResponseError as e:
+                # Chỉ chuyển sang BRPOP khi server không có lệnh BLMPOP; lỗi khác (WRONGTYPE, OOM, ...) raise như cũ
+                if "unknown command" not in str(e).lower():
+                    raise
+                logger.warning("BLMPOP not supported by Redis server, falling back to BRPOP")
+                self._use_blmpop = False
+
+        result = await self.redis_client.brpop("call_requests", timeout=POP_TIMEOUT)
+        if result is None:
+            return []
+        return [result[1]]
+            
+    async def process_call_request(self, request: Dict[str, Any]) -> Optional[bytes]:
+        """Xử lý một call request, trả về callback (JSON bytes) để gửi về Scheduler"""
         try:
             call_id = request.get("callId")
             phone = request.get("leadPhoneNumber")
@@ -80,27 +144,31 @@ class CallAgent:
             
             logger.info(f"Processing call {call_id} for {phone} (attempt {attempt})")
             
-            # Simulate cuộc gọi thực tế
-            outcome = await self.simulate_call(phone)
+            # Simulate cuộc gọi thực tế (giới hạn số cuộc gọi đồng thời)
+            async with self._sem:
+                outcome = await self.simulate_call(phone)
             
-            # Gửi callback về Scheduler
-            await self.send_callback({
-                "callId": call_id,
-                "campaignId": campaign_id,
-                "leadId": lead_id,
-                "leadPhoneNumber": phone,
-                "status": outcome,
-                "attempt": attempt,
-                "maxAttempts": request.get("maxAttempts", 3),
-                "retryInterval": request.get("retryInterval", 300),
-                "duration": 15,  # Simulate call duration
-                "timestamp": datetime.now().isoformat()
-            })
+            callback = encode_callback(
+                campaign_id,
+                request.get("maxAttempts", 3),
+                request.get("retryInterval", 300),
+                {
+                    "callId": call_id,
+                    "leadId": lead_id,
+                    "leadPhoneNumber": phone,
+                    "status": outcome,
+                    "attempt": attempt,
+                    "duration": 15,  # Simulate call duration
+                    "timestamp": datetime.now()
+                },
+            )
             
             logger.info(f"Call {call_id} completed with status: {outcome}")
+            return callback
             
         except Exception as e:
             logger.error(f"Error processing call request: {e}")
+            return None
             
     async def simulate_call(self, phone: str) -> str:
         """Simulate cuộc gọi thực tế"""
@@ -108,21 +176,19 @@ class CallAgent:
         await asyncio.sleep(2)
         
         # Simulate different outcomes
-        import random
-        outcomes = ["SUCCESS", "NO_ANSWER", "BUSY", "FAILED"]
-        weights = [0.7, 0.1, 0.1, 0.1]  # 30% success, 40% no answer, etc.
-        
-        return random.choices(outcomes, weights=weights)[0]
+        return _OUTCOMES[bisect(_CUM_WEIGHTS, random())]
         
-    async def send_callback(self, callback_data: Dict[str, Any]):
-        """Gửi callback về Scheduler qua Redis queue"""
+    async def send_callbacks(self, callbacks: List[bytes]):
+        """Gửi nhiều callback (đã encode) về Scheduler bằng một lệnh LPUSH"""
+        if not callbacks:
+            return
         try:
             # Gửi callback vào Redis queue
-            await self.redis_client.lpush("call_callbacks", json.dumps(callback_data))
-            logger.info(f"Callback sent successfully for call {callback_data['callId']}")
+            await self.redis_client.lpush("call_callbacks", *callbacks)
+            logger.info(f"Callbacks sent successfully for {len(callbacks)} calls")
                 
         except Exception as e:
-            logger.error(f"Error sending callback: {e}")
+            logger.error(f"Error sending callbacks: {e}")
 
 async def main():
     """Main function"""
@@ -135,7 +201,8 @@ async def main():
     try:
         # Kết nối và bắt đầu
         await call_agent.connect()
-        await call_agent.start()
+        workers = [asyncio.create_task(call_agent.start(i)) for i in range(WORKERS)]
+        await asyncio.gather(*workers)
         
     except KeyboardInterrupt:
         logger.info("Shutting down Call Agent...")
@@ -143,4 +210,7 @@ async def main():
         await call_agent.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
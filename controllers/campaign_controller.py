@@ -1,33 +1,84 @@
 import asyncio
 import logging
-from datetime import datetime
+import os
+import random
+import time
 import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Set, Tuple
 from models.campaign import Campaign
+from models.lead import Lead
 from models.config import Config
 from services.database_service import DatabaseService
-from typing import Optional
 from services.campaign_service import CampaignService
-import uuid, time
 logger = logging.getLogger(__name__)
 
+# Khoảng cách tối thiểu giữa 2 cuộc gọi tới cùng một lead (giây)
+LEAD_RATE_LIMIT_S = 60.0
+# Số mốc gọi tối đa giữ trong last_call_time (ngoài việc bỏ các mốc cũ hơn LEAD_RATE_LIMIT_S)
+LAST_CALL_MAX = 10_000
+# Số lead mỗi trang khi duyệt leads từ DB / số retry tối đa claim trong một lượt xử lý
+LEAD_BATCH = 200
+RETRY_BATCH = 10
+# Số trang leads tối đa đọc trong một lượt không gọi được ai (lượt sau đọc tiếp từ _lead_cursor)
+LEAD_PAGES_PER_PASS = 5
+# Số lead_id đã SUCCESS giữ trong bộ nhớ để bỏ qua khi duyệt lại (vượt quá thì xoá hết, học lại từ Redis)
+DONE_CACHE_MAX = 100_000
+
+# PRNG sinh call_id, seed một lần từ os.urandom (tránh syscall cho mỗi cuộc gọi)
+_call_id_rng = random.Random(os.urandom(32))
+# Process con sau fork phải seed lại, tránh sinh trùng chuỗi call_id với process cha
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: _call_id_rng.seed(os.urandom(32)))
+
+
+def _full_jitter(base: float, cap: float, attempt: int) -> float:
+    """Full jitter: ngẫu nhiên trong [0, min(cap, base * 2^attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** min(attempt, 32)))
+
+
+def _equal_jitter(base: float, cap: float, attempt: int) -> float:
+    """Equal jitter: nửa cố định + nửa ngẫu nhiên của min(cap, base * 2^attempt)"""
+    t = min(cap, base * 2 ** min(attempt, 32))
+    return t / 2 + random.uniform(0, t / 2)
+
 class CampaignController:
     """Controller cho xử lý campaign - quản lý logic nghiệp vụ của một campaign"""
     
     def __init__(self, campaign: Campaign, db_service: DatabaseService, campaign_service: CampaignService, 
                  config: Config):
         self.campaign = campaign
+        # id campaign dạng chuỗi dùng cho key Redis / query (id không đổi trong suốt vòng đời controller)
+        self._campaign_id_str = str(campaign.id)
         self.db_service = db_service
         self.campaign_service = campaign_service
         self.config = config
+        # Các field theo campaign của call/retry request, dựng lại khi campaign đổi
+        self._call_template = campaign_service.build_call_template(campaign)
         
         self.is_running = False
         self.is_stopped = False
         self._finished = False
         
-        self.last_call_time = {}
+        # lead_id -> time.monotonic() của lần gọi gần nhất, theo thứ tự gọi (cũ nhất ở đầu)
+        self.last_call_time: "OrderedDict[str, float]" = OrderedDict()
         self.processed_leads = 0
-        self.last_campaign_call_at: Optional[datetime] = None
-        self.redis = None        
+        # time.monotonic() của cuộc gọi gần nhất trong campaign
+        self.last_campaign_call_at: Optional[float] = None
+        self.redis = None
+        # Số lần liên tiếp không có lead / bị lỗi (reset khi tạo được cuộc gọi)
+        self._idle_attempts = 0
+        self._error_attempts = 0
+        # Được set khi nhận thông báo wake (pub/sub) -> cắt ngắn thời gian chờ khi không có lead
+        self._wake_event = asyncio.Event()
+        # (phút, kết quả) của lần kiểm tra khung giờ gần nhất; khung giờ chỉ đổi theo phút
+        self._tod_cache: Tuple[int, bool] = (-1, False)
+        # lead_id đã biết là SUCCESS (lead hoặc phone); trạng thái done không quay lại nên không bị cũ
+        self._done_leads: Set[str] = set()
+        # Vị trí keyset (id lead gọi/đọc gần nhất) để lượt sau đọc tiếp, không quét lại từ lead đầu
+        self._lead_cursor: Optional[str] = None
+
     async def start(self):
         """Bắt đầu controller cho campaign"""
         self.is_running = True
@@ -36,22 +87,31 @@ class CampaignController:
         while self.is_running and not self.is_stopped:
             try:
                 try:
-                    latest = await self.db_service.get_campaign_by_id(str(self.campaign.id))
+                    latest = await self.db_service.get_campaign_by_id(self._campaign_id_str)
                     if latest is None:
                         logger.info(f"Campaign {self.campaign.name} not found, stopping controller")
                         break
+                    if latest.time_of_day != self.campaign.time_of_day:
+                        self._tod_cache = (-1, False)
+                    if (latest.tenant_id, latest.name, latest.script_id) != \
+                            (self.campaign.tenant_id, self.campaign.name, self.campaign.script_id):
+                        self._call_template = self.campaign_service.build_call_template(latest)
                     self.campaign = latest
                 except Exception:
                     pass
 
+                # Lấy thời điểm một lần cho cả tick
+                tick_now = datetime.now()
+                tick_mono = time.monotonic()
+
                 # Nếu ngoài khung giờ campaign -> kết thúc controller để scheduler dọn dẹp và sẽ khởi tạo lại khi vào khung giờ
-                if not self.campaign_service.is_within_time_of_day(self.campaign, datetime.now()):
+                if not self._in_window(tick_now):
                     logger.info(f"Campaign {self.campaign.name} outside time window, stopping controller")
                     break
 
                 interval = getattr(self.campaign, "call_interval", None)
                 if isinstance(interval, int) and interval > 0 and self.last_campaign_call_at is not None:
-                    elapsed = (datetime.now() - self.last_campaign_call_at).total_seconds()
+                    elapsed = tick_mono - self.last_campaign_call_at
                     if elapsed < interval:
                         wait_time = max(0.5, interval - elapsed)
                         logger.debug(f"Campaign {self.campaign.name} waiting {wait_time:.1f}s for next call")
@@ -59,21 +119,28 @@ class CampaignController:
                         continue
 
                 # Thực hiện 1 lần xử lý: tạo 1 cuộc gọi nếu có lead phù hợp
-                made_call = await self._process_campaign_once()
+                made_call = await self._process_campaign_once(tick_now, tick_mono)
 
                 if made_call:
                     # Nếu vừa tạo cuộc gọi, cập nhật mốc thời gian gọi cuối
-                    self.last_campaign_call_at = datetime.now()
+                    self.last_campaign_call_at = time.monotonic()
+                    self._idle_attempts = 0
+                    self._error_attempts = 0
                     logger.debug(f"Campaign {self.campaign.name} made a call, waiting for next interval")
                     continue
                 else:
-                    logger.debug(f"Campaign {self.campaign.name} no leads to process, waiting...")
-                    await asyncio.sleep(5)
+                    self._error_attempts = 0
+                    delay = _full_jitter(self.config.IDLE_MIN_S, self.config.IDLE_MAX_S, self._idle_attempts)
+                    self._idle_attempts += 1
+                    logger.debug(f"Campaign {self.campaign.name} no leads to process, waiting {delay:.2f}s...")
+                    await self._wait_for_wake(delay)
                     continue
 
             except Exception as e:
                 logger.error(f"Error in campaign controller {self.campaign.name}: {e}", exc_info=True)
-                await asyncio.sleep(10)
+                delay = _equal_jitter(self.config.ERROR_BACKOFF_MIN_S, self.config.ERROR_BACKOFF_MAX_S, self._error_attempts)
+                self._error_attempts += 1
+                await asyncio.sleep(delay)
                 
         self._finished = True
         logger.info(f"Campaign controller finished for {self.campaign.name}")
@@ -81,128 +148,192 @@ class CampaignController:
     async def stop(self):
         self.is_stopped = True
         self.is_running = False
+        # Thoát ngay khỏi lần chờ idle thay vì đợi hết backoff
+        self._wake_event.set()
+        
+    def wake(self):
+        """Đánh thức controller đang chờ vì không có lead"""
+        self._idle_attempts = 0
+        self._wake_event.set()
+
+    async def _wait_for_wake(self, timeout: float):
+        """Chờ tối đa timeout giây hoặc tới khi có wake"""
+        try:
+            await asyncio.wait_for(self._wake_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wake_event.clear()
         
     def is_finished(self) -> bool:
         """Kiểm tra controller đã hoàn thành chưa"""
         return self._finished
         
-    async def _process_campaign_once(self) -> bool:
+    async def _process_campaign_once(self, tick_now: datetime, tick_mono: float) -> bool:
         """Thực hiện một lần xử lý: cố gắng tạo 1 cuộc gọi (new hoặc retry).
         Trả về True nếu đã tạo cuộc gọi, False nếu không có gì để làm.
         """
+        # Khung giờ kiểm tra một lần cho cả lượt, không lặp lại theo từng lead
+        if not self._in_window(tick_now):
+            logger.info(f"[SKIP] campaign {self.campaign.name} outside time window")
+            return False
+
         if self.redis is not None:
-            due_ids = await self.redis.claim_due_retries(str(self.campaign.id), limit=10)
-            for call_id in due_ids:
-                payload = await self.redis.get_call_payload(call_id)
-                lead_id = str(payload.get("lead_id"))
-                phone   = payload["phone"]
-                attempt = int(payload.get("attempt", 0))
-                max_attempts = int(payload.get("max_attempts", 3))
-                retry_interval_s = int(payload.get("retry_interval_s", 300))
-                try:
-                    if await self.redis.is_lead_success(str(self.campaign.id), str(lead_id)):
-                        try:
-                            await self.redis.save_success_and_finalize(call_id)
-                            await self.redis.remove_retry(str(self.campaign.id), call_id)
-                        except Exception:
-                            pass
-                        logger.info(f"[RETRY-SKIP] lead {lead_id} already SUCCESS, cleaned {call_id}")
-                        continue
-                except Exception:
-                    pass
+            await self._process_due_retries(tick_now)
 
-                try:
-                    if await self.redis.is_phone_success(str(self.campaign.id), phone):
-                        try:
-                            await self.redis.save_success_and_finalize(call_id)
-                            await self.redis.remove_retry(str(self.campaign.id), call_id)
-                        except Exception:
-                            pass
-                        logger.info(f"[RETRY-SKIP] phone {phone} already SUCCESS, cleaned {call_id}")
-                        continue
-                except Exception:
-                    pass
+        # Nếu không có retry phù hợp, thử new leads: đọc tiếp từ vị trí của lượt trước,
+        # hết danh sách thì quay lại lead đầu; tối đa một vòng danh sách và LEAD_PAGES_PER_PASS trang mỗi lượt
+        start = self._lead_cursor
+        wrapped = start is None
+        pages = 0
+        while True:
+            pending_leads = await self.db_service.get_pending_leads_for_campaign(
+                self.campaign.id, LEAD_BATCH, after=self._lead_cursor
+            )
+            if not pending_leads:
+                self._lead_cursor = None
+                if wrapped:
+                    return False
+                wrapped = True
+                continue
+            # Đã quay vòng: dừng khi tới lại vị trí bắt đầu
+            reached_start = False
+            if wrapped and start is not None:
+                for i, lead in enumerate(pending_leads):
+                    if lead.id == start:
+                        pending_leads, reached_start = pending_leads[:i], True
+                        break
+            called = await self._call_first_eligible(pending_leads, tick_now, tick_mono)
+            if called is not None:
+                self._lead_cursor = called.id
+                return True
+            if reached_start:
+                return False
+            self._lead_cursor = pending_leads[-1].id
+            pages += 1
+            if pages >= LEAD_PAGES_PER_PASS:
+                return False
 
-                # Gửi retry request cho Call Agent
-                retry_request = {
-                    "callId": call_id,
-                    "tenantId": str(self.campaign.tenant_id) if self.campaign.tenant_id else None,
-                    "campaignId": str(self.campaign.id) if self.campaign.id else None,
-                    "campaignCode": self.campaign.name,
-                    "scriptId": str(self.campaign.script_id) if self.campaign.script_id else None,
-                    "leadId": str(lead_id) if lead_id else None,
-                    "leadPhoneNumber": phone,
-                    "isRetry": True,
-                    "attempt": attempt,
-                    "maxAttempts": max_attempts,
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-                if self.redis is not None:
-                    await self.redis.send_call_request(retry_request)
-                    logger.info(f"Sent retry request {call_id} for lead {phone} to Call Agent")
-                    # Đánh dấu in-progress cho lead/phone khi gửi retry để tránh gửi trùng
-                    try:
-                        await self.redis.mark_inprogress(str(self.campaign.id), str(lead_id))
-                        await self.redis.mark_phone_inprogress(str(self.campaign.id), phone)
-                        logger.info(f"[INPROG] (retry) mark lead {lead_id} and phone {phone} as in-progress")
-                    except Exception:
-                        pass
-                else:
-                    logger.warning(f"Redis not available, cannot send retry request for {call_id}")
+    async def _call_first_eligible(self, pending_leads, tick_now: datetime, tick_mono: float) -> Optional[Lead]:
+        """Tạo cuộc gọi cho lead đầu tiên trong trang đủ điều kiện; trả về lead đã gọi (None nếu không gọi)"""
+        # Bỏ các lead đã biết là SUCCESS ở các lượt trước, không hỏi lại Redis
+        done_leads = self._done_leads
+        if done_leads:
+            pending_leads = [lead for lead in pending_leads if lead.id not in done_leads]
+        if not pending_leads:
+            return None
 
-        # Nếu không có retry phù hợp, thử new leads
-        pending_leads = await self.db_service.get_pending_leads_for_campaign(self.campaign.id)
-        for lead in pending_leads:
-            if await self._should_make_call(lead):
-                await self._create_call(lead)
-                return True
+        # Lấy trạng thái Redis của toàn bộ page lead trong một round-trip
+        if self.redis is not None:
+            states = await self.redis.bulk_lead_state(
+                self._campaign_id_str,
+                [lead.id for lead in pending_leads],
+                [lead.phone_number for lead in pending_leads],
+            )
+        else:
+            states = [None] * len(pending_leads)
 
-        return False
+        for lead, state in zip(pending_leads, states):
+            if state is not None and (state[0] or state[1]):
+                if len(done_leads) >= DONE_CACHE_MAX:
+                    done_leads.clear()
+                done_leads.add(lead.id)
+            if not self._should_make_call(lead, state, tick_now, tick_mono):
+                continue
+            # Kiểm tra lại + đánh dấu in-progress nguyên tử trước khi gửi request
+            if self.redis is not None and not await self.redis.try_claim_lead(
+                self._campaign_id_str, lead.id, lead.phone_number
+            ):
+                continue
+            await self._create_call(lead, tick_mono)
+            return lead
+
+        return None
                 
-    async  def _should_make_call(self, lead) -> bool:
-        """Kiểm tra có nên tạo cuộc gọi không"""
-            
-        now = datetime.now()
-        if self.redis is not None:
+    async def _process_due_retries(self, tick_now: datetime):
+        """Gửi lại các retry đến hạn: một lần claim (Lua) + một LPUSH cho cả lô"""
+        # Claim + lấy payload + bỏ retry của lead/phone đã SUCCESS + đánh dấu in-progress (Lua)
+        claimed = await self.redis.claim_retries_for_dispatch(self._campaign_id_str, limit=RETRY_BATCH)
+        if not claimed:
+            return
+        template = self._call_template
+        to_send = []
+        for call_id, status, payload in claimed:
+            if status == "lead_done":
+                logger.info(f"[RETRY-SKIP] lead {payload.get('lead_id')} already SUCCESS, cleaned {call_id}")
+                continue
+            if status == "phone_done":
+                logger.info(f"[RETRY-SKIP] phone {payload.get('phone')} already SUCCESS, cleaned {call_id}")
+                continue
+            if not payload:
+                logger.warning(f"[RETRY-SKIP] missing payload for {call_id}")
+                continue
+
+            # Giá trị scalar trong payload từ Redis luôn là chuỗi (_maybe_json chỉ parse dict/list)
+            lead_id = payload.get("lead_id")
+            # Retry request cho Call Agent
+            to_send.append({
+                "callId": call_id,
+                **template,
+                "leadId": lead_id or None,
+                "leadPhoneNumber": str(payload["phone"]),
+                "isRetry": True,
+                "attempt": int(payload.get("attempt", 0)),
+                "maxAttempts": int(payload.get("max_attempts", 3)),
+                "timestamp": tick_now
+            })
+
+        if to_send:
+            await self.redis.send_call_requests(to_send)
+            for req in to_send:
+                logger.info(f"Sent retry request {req['callId']} for lead {req['leadPhoneNumber']} to Call Agent")
+                # Lead/phone đã được đánh dấu in-progress ngay khi claim (trong Lua script)
+                logger.info(f"[INPROG] (retry) lead {req['leadId']} and phone {req['leadPhoneNumber']} are in-progress")
+
+    def _in_window(self, now: datetime) -> bool:
+        """is_within_time_of_day, cache theo phút (tính lại tối đa 1 lần/phút)"""
+        minute_key = int(now.timestamp()) // 60
+        if self._tod_cache[0] == minute_key:
+            return self._tod_cache[1]
+        result = self.campaign_service.is_within_time_of_day(self.campaign, now)
+        self._tod_cache = (minute_key, result)
+        return result
+
+    def _should_make_call(self, lead, state: Optional[Tuple[bool, bool, bool, bool]],
+                          tick_now: datetime, tick_mono: float) -> bool:
+        """Kiểm tra có nên tạo cuộc gọi không.
+
+        state: kết quả RedisService.bulk_lead_state cho lead (None nếu không có Redis).
+        """
+        if state is not None:
+            done, phone_done, inprog, phone_inprog = state
             # Nếu lead đã thành công -> bỏ qua
-            done = await self.redis.is_lead_success(str(self.campaign.id), str(lead.id))
             if done:
-                logger.info(f"[SKIP] lead {lead.id} already SUCCESS in Redis")
+                logger.debug(f"[SKIP] lead {lead.id} already SUCCESS in Redis")
+                return False
+            if phone_done:
+                logger.debug(f"[SKIP] phone {lead.phone_number} already SUCCESS in Redis")
                 return False
-            try:
-                if await self.redis.is_phone_success(str(self.campaign.id), lead.phone_number):
-                    logger.info(f"[SKIP] phone {lead.phone_number} already SUCCESS in Redis")
-                    return False
-            except Exception:
-                pass
             # Nếu lead đang chờ kết quả (đã gửi message đi) -> bỏ qua
-            inprog = await self.redis.is_inprogress(str(self.campaign.id), str(lead.id))
-            if inprog:
+            if inprog or phone_inprog:
                 return False
-            try:
-                if await self.redis.is_phone_inprogress(str(self.campaign.id), lead.phone_number):
-                    return False
-            except Exception:
-                pass
-        if not self.campaign_service.is_within_time_of_day(self.campaign, now):
-            logger.info(f"[SKIP] lead {lead.id} outside time window")
-            return False
             
-        if lead.id in self.last_call_time:
-            time_diff = now - self.last_call_time[lead.id]
-            if time_diff.total_seconds() < 60:
-                logger.info(f"[SKIP] lead {lead.id} rate-limited {time_diff.total_seconds():.1f}s < 60s")
+        last = self.last_call_time.get(lead.id)
+        if last is not None:
+            elapsed = tick_mono - last
+            if elapsed < LEAD_RATE_LIMIT_S:
+                logger.debug(f"[SKIP] lead {lead.id} rate-limited {elapsed:.1f}s < {LEAD_RATE_LIMIT_S:.0f}s")
                 return False
                 
         return True
         
-    async def _create_call(self, lead):
+    async def _create_call(self, lead, tick_mono: float):
         """Tạo cuộc gọi mới - gửi request cho Call Agent"""
-        call_id = str(uuid.uuid4())
+        call_id = self._next_call_id()
         
         # Tạo call request message
-        call_request = self.campaign_service.create_call_message(call_id, self.campaign, lead)
+        call_request = self.campaign_service.create_call_message(
+            call_id, self.campaign, lead, template=self._call_template
+        )
         
         # Gửi call request cho Call Agent qua Redis
         if self.redis is not None:
@@ -212,20 +343,27 @@ class CampaignController:
             logger.warning(f"Redis not available, cannot send call request for {call_id}")
         
         # Cập nhật thời gian gọi cuối
-        self.last_call_time[lead.id] = datetime.now()
+        self._record_call_time(lead.id, tick_mono)
         self.processed_leads += 1
-
-        # Đánh dấu lead đang xử lý để tránh gửi trùng trước khi có callback kết quả
-        try:
-            if self.redis is not None:
-                await self.redis.mark_inprogress(str(self.campaign.id), str(lead.id))
-                await self.redis.mark_phone_inprogress(str(self.campaign.id), lead.phone_number)
-                logger.info(f"[INPROG] mark lead {lead.id} and phone {lead.phone_number} as in-progress")
-        except Exception:
-            pass
+        # Lead/phone đã được đánh dấu in-progress bởi try_claim_lead trước khi gửi
         
         logger.info(f"Created call request {call_id} for lead {lead.phone_number}")
         
+    def _next_call_id(self) -> str:
+        """call_id dạng UUID4 từ PRNG trong tiến trình (chỉ cần duy nhất, không cần an toàn mật mã)"""
+        return str(uuid.UUID(int=_call_id_rng.getrandbits(128), version=4))
+
+    def _record_call_time(self, lead_id: str, now_mono: float):
+        """Ghi mốc gọi của lead; bỏ các mốc cũ ở đầu OrderedDict (hết cửa sổ rate-limit hoặc vượt LAST_CALL_MAX)"""
+        calls = self.last_call_time
+        calls[lead_id] = now_mono
+        calls.move_to_end(lead_id)
+        while calls:
+            oldest_ts = next(iter(calls.values()))
+            if now_mono - oldest_ts < LEAD_RATE_LIMIT_S and len(calls) <= LAST_CALL_MAX:
+                break
+            calls.popitem(last=False)
+
     def get_status(self) -> dict:
         """Lấy trạng thái của campaign controller"""
         return {
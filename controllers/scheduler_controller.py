@@ -1,46 +1,66 @@
 import asyncio
-import threading
 import logging
-from typing import Dict, Set
+from typing import Dict, List, Set
+from models.campaign import Campaign
+from models.call_callback import CallCallback
 from models.config import Config
 from services.database_service import DatabaseService
 from services.campaign_service import CampaignService
 from controllers.campaign_controller import CampaignController
 from services.redis_service import RedisService
+
 logger = logging.getLogger(__name__)
 
+# Thời gian block tối đa khi chờ callback (giây); có callback là trả về ngay
+CALLBACK_POP_TIMEOUT = 5
+# Số callback tối đa lấy trong một lần pop
+CALLBACK_BATCH = 64
+# Thời gian chờ controller tự dừng (giây) trước khi huỷ task
+STOP_TIMEOUT = 5
+
 class SchedulerController:
     """Controller chính cho scheduler - điều phối toàn bộ hệ thống"""
     
     def __init__(self, config: Config):
         self.config = config
-        self.db_service = DatabaseService(config.DATABASE_URL)
+        self.db_service = DatabaseService(
+            config.DATABASE_URL, min_size=config.DB_POOL_MIN_SIZE, max_size=config.DB_POOL_MAX_SIZE,
+            campaign_cache_ttl=config.CAMPAIGN_CACHE_TTL, notify_channel=config.CAMPAIGN_NOTIFY_CHANNEL,
+        )
         self.campaign_service = CampaignService(config)
-        self.redis_service = RedisService(config.REDIS_URL)
+        self.redis_service = RedisService(
+            config.REDIS_URL, config.REDIS_MAX_CONNECTIONS, inprogress_ttl=config.INPROGRESS_TTL,
+            protocol=config.REDIS_PROTOCOL,
+        )
         
         # Track active campaign controllers
         self.active_controllers: Dict[str, CampaignController] = {}
         self.processed_campaigns: Set[str] = set()
-        # Threading resources per campaign
-        self.controller_threads: Dict[str, threading.Thread] = {}
-        self.controller_loops: Dict[str, asyncio.AbstractEventLoop] = {}
-        self.controller_db_services: Dict[str, DatabaseService] = {}
-        self.controller_redis_services: Dict[str, RedisService] = {}
+        # Task chạy controller của từng campaign (cùng event loop, dùng chung DB pool + Redis)
+        self.active_tasks: Dict[str, asyncio.Task] = {}
+        # (campaign_id, task) của các controller task vừa kết thúc (đẩy vào từ done callback)
+        self._finished_q: asyncio.Queue = asyncio.Queue()
         # Background callback listener task
         self._callback_task: asyncio.Task | None = None
+        # Background wake listener task (pub/sub camp:*:wake)
+        self._wake_task: asyncio.Task | None = None
         
     async def initialize(self):
         """Khởi tạo các services"""
         await self.db_service.connect()
         await self.redis_service.connect()
         logger.info("Scheduler controller initialized")
-        # Start background callback listener (independent from campaign threads)
+        # Start background callback listener (independent from campaign tasks)
         try:
             if self._callback_task is None or self._callback_task.done():
                 self._callback_task = asyncio.create_task(self._callback_listener())
                 logger.info("Callback listener started")
         except Exception as e:
             logger.warning(f"Failed to start callback listener: {e}")
+        # Wake listener giữ 1 connection (PSUBSCRIBE) -> chỉ chạy khi có producer publish_wake
+        if self.config.WAKE_PUBSUB_ENABLED and (self._wake_task is None or self._wake_task.done()):
+            self._wake_task = asyncio.create_task(self._wake_listener())
+            logger.info("Wake listener started")
         
     async def cleanup(self):
         """Dọn dẹp resources"""
@@ -56,40 +76,61 @@ class SchedulerController:
                 logger.warning(f"Error stopping callback listener: {e}")
             finally:
                 self._callback_task = None
+        if self._wake_task is not None:
+            self._wake_task.cancel()
+            await asyncio.gather(self._wake_task, return_exceptions=True)
+            self._wake_task = None
         # Stop all campaign controllers
         for controller in self.active_controllers.values():
             await controller.stop()
+        # Controller có thể đang sleep (backoff) -> huỷ task thay vì chờ
+        for task in self.active_tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.active_tasks.values(), return_exceptions=True)
+        self.active_tasks.clear()
+        self.active_controllers.clear()
             
         await self.db_service.disconnect()
         await self.redis_service.close()
         logger.info("Scheduler controller cleaned up")
         
-    async def run_cycle(self):
-        """Chạy một chu kỳ kiểm tra và xử lý"""
+    async def run_cycle(self) -> bool:
+        """Chạy một chu kỳ kiểm tra và xử lý.
+        Trả về True nếu tập controllers thay đổi (có campaign được khởi tạo/dừng/dọn dẹp).
+        """
         logger.debug("Starting scheduler cycle...")
+        before = set(self.active_controllers)
         
         try:
+            # Lấy campaigns running (đã lọc start/end trong SQL) + paused/ended trong một query rồi chia theo status
+            campaigns = await self.db_service.get_scheduler_campaigns()
+            running = [c for c in campaigns if c.status == "running"]
+            stopped = [c for c in campaigns if c.status != "running"]
+            
             # 1. Khởi tạo/duy trì controllers cho các campaigns đang active trước
-            await self._process_active_campaigns()
+            await self._process_active_campaigns(running)
             
             # 2. Kiểm tra campaigns cần dừng/tạm dừng
-            await self._process_stopped_campaigns()
+            await self._process_stopped_campaigns(stopped)
             
             # 3. Cleanup finished controllers
-            await self._cleanup_finished_controllers()
+            self._retire_finished_controllers()
             
         except Exception as e:
             logger.error(f"Error in scheduler cycle: {e}")
+        return set(self.active_controllers) != before
 
     async def _callback_listener(self):
-        """Background loop to consume callbacks independently of campaign threads."""
+        """Background loop to consume callbacks independently of campaign tasks."""
         logger.debug("Callback listener loop started")
         try:
             while True:
                 try:
-                    callbacks = await self.redis_service.get_call_callbacks(timeout=1)
-                    for callback in callbacks:
-                        await self._handle_call_callback(callback)
+                    callbacks = await self.redis_service.get_call_callbacks(
+                        timeout=CALLBACK_POP_TIMEOUT, count=CALLBACK_BATCH
+                    )
+                    if callbacks:
+                        await self._handle_call_callbacks(callbacks)
                 except asyncio.CancelledError:
                     raise
                 except Exception as e:
@@ -98,6 +139,22 @@ class SchedulerController:
         finally:
             logger.debug("Callback listener loop stopped")
     
+    async def _wake_listener(self):
+        """Nhận thông báo lead mới qua pub/sub và đánh thức controller tương ứng."""
+        while True:
+            try:
+                async for campaign_id in self.redis_service.iter_wakes():
+                    # Key của active_controllers là campaign.id gốc (uuid, ...), channel luôn là chuỗi
+                    for cid, controller in self.active_controllers.items():
+                        if str(cid) == campaign_id:
+                            controller.wake()
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in wake listener: {e}")
+                await asyncio.sleep(1)
+    
     async def _process_call_callbacks(self):
         """Xử lý callbacks từ Call Agent"""
         try:
@@ -107,248 +164,178 @@ class SchedulerController:
             if callbacks:
                 logger.info(f"Processing {len(callbacks)} callbacks from Call Agent")
                 
-            for callback in callbacks:
-                await self._handle_call_callback(callback)
+            if callbacks:
+                await self._handle_call_callbacks(callbacks)
                 
         except Exception as e:
             logger.error(f"Error processing call callbacks: {e}", exc_info=True)
     
     async def _handle_call_callback(self, callback_data: dict):
         """Xử lý một callback từ Call Agent"""
-        try:
-            call_id = callback_data.get("callId")
-            status = callback_data.get("status")
-            campaign_id = str(callback_data.get("campaignId", ""))
-            lead_id = str(callback_data.get("leadId", ""))
-            
-            logger.info(f"Received callback for call {call_id}: {status}")
-            
-            # Tìm campaign controller tương ứng
-            controller = self.active_controllers.get(campaign_id)
-            if not controller:
-                logger.warning(f"No active controller found for campaign {campaign_id}")
-                try:
-                    if status == "SUCCESS":
-                        if self.redis_service:
-                            await self.redis_service.mark_lead_success(campaign_id, lead_id)
-                            await self.redis_service.mark_phone_success(campaign_id, callback_data.get("leadPhoneNumber", ""))
+        await self._handle_call_callbacks([callback_data])
 
-                            try:
-                                await self.redis_service.save_success_and_finalize(call_id)
-                                await self.redis_service.remove_retry(campaign_id, call_id)
-                            except Exception:
-                                pass
-                    else:
-                        attempt = int(callback_data.get("attempt", 0))
-                        max_attempts = int(callback_data.get("maxAttempts", 3))
-                        if attempt + 1 < max_attempts and self.redis_service:
-                            retry_interval = int(callback_data.get("retryInterval", 300))
-                            payload = {
-                                "campaign_id": campaign_id,
-                                "lead_id": lead_id,
-                                "phone": callback_data.get("leadPhoneNumber", ""),
-                                "attempt": attempt + 1,
-                                "max_attempts": max_attempts,
-                                "retry_interval_s": retry_interval,
-                                "call_id": call_id,
-                                "last_outcome": status,
-                            }
-                            await self.redis_service.save_failure_and_schedule_retry(
-                                campaign_id, call_id, payload, delay_seconds=retry_interval
-                            )
-                    # Clear in-progress nếu có
-                    if self.redis_service:
-                        await self.redis_service.clear_inprogress(campaign_id, lead_id)
-                        try:
-                            await self.redis_service.clear_phone_inprogress(campaign_id, callback_data.get("leadPhoneNumber", ""))
-                        except Exception:
-                            pass
-                except Exception as e:
-                    logger.error(f"Fallback Redis update failed for call {call_id}: {e}")
-                finally:
-                    return
-            
-            if status == "SUCCESS":
-                if controller.redis:
-                    await controller.redis.mark_lead_success(campaign_id, lead_id)
-                    await controller.redis.mark_phone_success(campaign_id, callback_data.get("leadPhoneNumber", ""))
-                    try:
-                        await controller.redis.save_success_and_finalize(call_id)
-                        await controller.redis.remove_retry(campaign_id, call_id)
-                    except Exception:
-                        pass
-                logger.info(f"Lead {lead_id} marked as SUCCESS")
-                
-            else:
-                # Xử lý retry nếu cần
-                attempt = callback_data.get("attempt", 0)
-                max_attempts = callback_data.get("maxAttempts", 3)
-                
-                if attempt + 1 < max_attempts:
+    async def _handle_call_callbacks(self, callbacks: List[dict]):
+        """Xử lý một lô callback từ Call Agent: gom theo campaign, ghi Redis cho cả lô trong một pipeline"""
+        # campaign_id -> các callback (đã parse) của campaign đó
+        by_campaign: Dict[str, List[CallCallback]] = {}
+        for callback_data in callbacks:
+            try:
+                cb = CallCallback.from_dict(callback_data)
+            except Exception as e:
+                call_id = callback_data.get("callId", "unknown") if isinstance(callback_data, dict) else "unknown"
+                logger.error(f"Invalid callback for call {call_id}: {e}")
+                continue
+            by_campaign.setdefault(cb.campaign_id, []).append(cb)
+
+        successes = []  # (campaign_id, call_id, lead_id, phone)
+        retries = []    # (campaign_id, call_id, payload, delay_seconds)
+        finished = []   # (campaign_id, lead_id, phone) -> gỡ in-progress (retry thì giữ tới khi đến hạn)
+        per_callback = []  # (cb, success, retry, finished) của từng callback, dùng khi ghi cả lô thất bại
+        # Key của active_controllers là campaign.id gốc (uuid, ...), campaignId trong callback là chuỗi
+        active_ids = {str(cid) for cid in self.active_controllers}
+        for campaign_id, items in by_campaign.items():
+            if campaign_id not in active_ids:
+                logger.warning(f"No active controller found for campaign {campaign_id} ({len(items)} callbacks)")
+            for cb in items:
+                logger.info(f"Received callback for call {cb.call_id}: {cb.status}")
+
+                success = retry = done = None
+                if cb.status == "SUCCESS":
+                    success = (campaign_id, cb.call_id, cb.lead_id, cb.phone)
+                    successes.append(success)
+                elif cb.attempt + 1 < cb.max_attempts:
                     # Lên lịch retry
-                    retry_interval = callback_data.get("retryInterval", 300)
                     payload = {
                         "campaign_id": campaign_id,
-                        "lead_id": lead_id,
-                        "phone": callback_data.get("leadPhoneNumber", ""),
-                        "attempt": attempt + 1,
-                        "max_attempts": max_attempts,
-                        "retry_interval_s": retry_interval,
-                        "call_id": call_id,
-                        "last_outcome": status,
+                        "lead_id": cb.lead_id,
+                        "phone": cb.phone,
+                        "attempt": cb.attempt + 1,
+                        "max_attempts": cb.max_attempts,
+                        "retry_interval_s": cb.retry_interval,
+                        "call_id": cb.call_id,
+                        "last_outcome": cb.status,
                     }
-                    
-                    if controller.redis:
-                        await controller.redis.save_failure_and_schedule_retry(
-                            campaign_id, call_id, payload, delay_seconds=retry_interval
-                        )
-                    logger.info(f"Scheduled retry for call {call_id} (attempt {attempt + 1})")
+                    retry = (campaign_id, cb.call_id, payload, cb.retry_interval)
+                    retries.append(retry)
                 else:
                     # Hết lượt retry
-                    logger.info(f"Call {call_id} exceeded max attempts, marking as failed")
-            
-            # Clear in-progress status
-            if controller.redis:
-                await controller.redis.clear_inprogress(campaign_id, lead_id)
-                await controller.redis.clear_phone_inprogress(campaign_id, callback_data.get("leadPhoneNumber", ""))
-                
+                    logger.info(f"Call {cb.call_id} exceeded max attempts, marking as failed")
+                if retry is None:
+                    done = (campaign_id, cb.lead_id, cb.phone)
+                    finished.append(done)
+                per_callback.append((cb, success, retry, done))
+
+        if not per_callback:
+            return
+        try:
+            await self.redis_service.apply_callback_results(successes, retries, finished)
         except Exception as e:
-            logger.error(f"Error handling callback for call {callback_data.get('callId', 'unknown')}: {e}")
+            # Không bỏ cả lô: ghi lại từng callback, chỉ mất callback bị lỗi
+            logger.error(f"Redis update failed for {len(per_callback)} callbacks, retrying one by one: {e}")
+            for cb, success, retry, done in per_callback:
+                try:
+                    await self.redis_service.apply_callback_results(
+                        [success] if success else [], [retry] if retry else [], [done] if done else []
+                    )
+                except Exception as e:
+                    logger.error(f"Redis update failed for call {cb.call_id} (campaign {cb.campaign_id}): {e}")
+            return
+        for _, _, lead_id, _ in successes:
+            logger.info(f"Lead {lead_id} marked as SUCCESS")
+        for _, call_id, payload, _ in retries:
+            logger.info(f"Scheduled retry for call {call_id} (attempt {payload['attempt']})")
             
-    async def _process_active_campaigns(self):
-        """Xử lý các campaigns đang active"""
-        # Lấy danh sách campaigns đang ở trạng thái running từ database
-        campaigns = await self.db_service.get_running_campaigns()
-        logger.info(f"[DEBUG] Số các chiến dịch đang running là: {len(campaigns)}")
+    async def _process_active_campaigns(self, campaigns: List[Campaign]):
+        """Xử lý các campaigns đang active (campaigns: các campaign status running)"""
+        logger.debug("Số các chiến dịch đang running là: %d", len(campaigns))
         
         # Lấy danh sách campaings thỏa mãn thời gian thực hiện cuộc gọi
         active_campaigns = self.campaign_service.filter_active_campaigns(campaigns)
-        logger.info(f"[DEBUG] filtered_active_campaigns={len(active_campaigns)}")
+        logger.debug("filtered_active_campaigns=%d", len(active_campaigns))
         
-        # Cleanup dead controllers first
-        await self._cleanup_dead_controllers()
+        # Dọn các controller đã kết thúc trước khi tính slot còn trống
+        self._retire_finished_controllers()
         
-        # Check thread limit
-        current_thread_count = len(self.active_controllers)
-        max_threads = self.config.MAX_CONCURRENT_CAMPAIGNS
+        # Check controller limit
+        current_count = len(self.active_controllers)
+        max_controllers = self.config.MAX_CONCURRENT_CAMPAIGNS
         
-        if current_thread_count >= max_threads:
-            logger.warning(f"Thread limit reached: {current_thread_count}/{max_threads}. Skipping new campaigns.")
+        if current_count >= max_controllers:
+            logger.warning(f"Controller limit reached: {current_count}/{max_controllers}. Skipping new campaigns.")
             return
         
-        available_slots = max_threads - current_thread_count
-        logger.info(f"Available thread slots: {available_slots}/{max_threads}")
+        available_slots = max_controllers - current_count
+        logger.debug("Available controller slots: %d/%d", available_slots, max_controllers)
         
-        for campaign in active_campaigns[:available_slots]:  # Limit by available slots
-            # Kiểm tra xem campaign đã có controller chưa
-            if campaign.id not in self.active_controllers:
-                # Kiểm tra có leads cần gọi không
-                pending_leads = await self.db_service.get_pending_leads_for_campaign(campaign.id)
-                logger.info(f"[DEBUG] campaign_id={campaign.id} name={campaign.name} pending_leads={len(pending_leads)}")
-                
-                if pending_leads:
-                    logger.info(f"Starting controller for campaign {campaign.name} with {len(pending_leads)} leads")
-
-                    # Create per-campaign db service (isolated pool per thread)
-                    per_db = DatabaseService(self.config.DATABASE_URL)
-                    
-                    # Create per-campaign redis service (isolated connection per thread)
-                    per_redis = RedisService(self.config.REDIS_URL)
-
-                    # Create controller object
-                    controller = CampaignController(
-                        campaign=campaign,
-                        db_service=per_db,
-                        campaign_service=self.campaign_service,
-                        config=self.config
-                    )
+        # Campaign chưa có controller (giới hạn theo số slot còn trống)
+        candidates = [
+            c for c in active_campaigns[:available_slots] if c.id not in self.active_controllers
+        ]
+        if not candidates:
+            return
+        # Kiểm tra có leads cần gọi không cho tất cả candidates trong một query
+        # (controller sẽ tự lấy danh sách leads)
+        with_leads = await self.db_service.get_campaign_ids_with_pending_leads([c.id for c in candidates])
+        
+        for campaign in candidates:
+            has_leads = campaign.id in with_leads
+            logger.debug("campaign_id=%s name=%s has_pending_leads=%s", campaign.id, campaign.name, has_leads)
+            
+            if has_leads:
+                logger.info(f"Starting controller for campaign {campaign.name}")
 
-                    self.active_controllers[campaign.id] = controller
-                    self.controller_db_services[campaign.id] = per_db
-                    self.controller_redis_services[campaign.id] = per_redis
+                # Controller dùng chung DB pool và Redis client của scheduler
+                controller = CampaignController(
+                    campaign=campaign,
+                    db_service=self.db_service,
+                    campaign_service=self.campaign_service,
+                    config=self.config
+                )
+                controller.attach_redis(self.redis_service)
 
-                    # Start controller in a dedicated thread
-                    t = threading.Thread(target=self._run_controller_thread, args=(campaign.id,), daemon=True)
-                    self.controller_threads[campaign.id] = t
-                    t.start()
+                self.active_controllers[campaign.id] = controller
+                task = asyncio.create_task(controller.start(), name=f"campaign-{campaign.id}")
+                task.add_done_callback(
+                    lambda t, cid=campaign.id: self._finished_q.put_nowait((cid, t))
+                )
+                self.active_tasks[campaign.id] = task
                     
-    async def _process_stopped_campaigns(self):
-        """Xử lý các campaigns cần dừng hoặc tạm dừng"""
-        # Lấy campaigns đã ended hoặc paused
-        stopped_campaigns = await self.db_service.get_stopped_campaigns()
-        
+    async def _process_stopped_campaigns(self, stopped_campaigns: List[Campaign]):
+        """Xử lý các campaigns cần dừng hoặc tạm dừng (stopped_campaigns: status paused/ended)"""
+        tasks = []
         for campaign in stopped_campaigns:
             if campaign.id in self.active_controllers:
                 logger.info(f"Stopping controller for campaign {campaign.name} (status: {campaign.status})")   
 
-                # Stop controller via its own loop
-                controller = self.active_controllers[campaign.id]
-                loop = self.controller_loops.get(campaign.id)
-                if loop is not None:
-                    try:
-                        fut = asyncio.run_coroutine_threadsafe(controller.stop(), loop)
-                        fut.result(timeout=5)
-                    except Exception as e:
-                        logger.warning(f"Failed to stop controller for {campaign.id}: {e}")
-
-                # Do not remove here; wait for cleanup when finished
-                
-    async def _cleanup_dead_controllers(self):
-        """Dọn dẹp các controllers đã chết hoặc hoàn thành"""
-        dead_controllers = []
-        
-        for campaign_id, thread in self.controller_threads.items():
-            if not thread.is_alive():
-                dead_controllers.append(campaign_id)
-                logger.warning(f"Dead thread detected for campaign {campaign_id}")
-        
-        for campaign_id in dead_controllers:
-            logger.info(f"Cleaning up dead controller for campaign {campaign_id}")
-            # Clean maps
-            self.active_controllers.pop(campaign_id, None)
-            self.controller_loops.pop(campaign_id, None)
-            self.controller_db_services.pop(campaign_id, None)
-            self.controller_threads.pop(campaign_id, None)
-            self.processed_campaigns.discard(campaign_id)
-    
-    async def _cleanup_finished_controllers(self):
-        """Dọn dẹp các controllers đã hoàn thành"""
-        finished_controllers = []
+                await self.active_controllers.pop(campaign.id).stop()
+                task = self.active_tasks.pop(campaign.id, None)
+                if task is not None and not task.done():
+                    tasks.append(task)
+                self.processed_campaigns.discard(campaign.id)
         
-        for campaign_id, controller in self.active_controllers.items():
-            if controller.is_finished():
-                finished_controllers.append(campaign_id)
-        
-        for campaign_id in finished_controllers:
+        if not tasks:
+            return
+        # Chờ các controller tự thoát (song song, tối đa STOP_TIMEOUT), task nào còn chạy thì huỷ
+        _, pending = await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+                
+    def _retire_finished_controllers(self):
+        """Dọn dẹp các controllers đã kết thúc (hoàn thành, lỗi hoặc bị huỷ).
+        Chỉ xử lý các task có trong _finished_q thay vì duyệt toàn bộ controllers.
+        """
+        while not self._finished_q.empty():
+            campaign_id, task = self._finished_q.get_nowait()
+            # Bỏ qua task cũ (campaign đã được dọn / khởi tạo controller mới)
+            if self.active_tasks.get(campaign_id) is not task:
+                continue
+            if not task.cancelled() and task.exception() is not None:
+                logger.warning(f"Controller task crashed for campaign {campaign_id}: {task.exception()}")
             logger.info(f"Cleaning up finished controller for campaign {campaign_id}")
-            
-            # Stop controller nếu chưa dừng
-            controller = self.active_controllers.get(campaign_id)
-            if controller and not controller.is_stopped:
-                await controller.stop()
-            
             # Clean maps
             self.active_controllers.pop(campaign_id, None)
-            self.controller_loops.pop(campaign_id, None)
-            
-            # Disconnect db service
-            db_service = self.controller_db_services.pop(campaign_id, None)
-            if db_service:
-                try:
-                    await db_service.disconnect()
-                except Exception as e:
-                    logger.warning(f"Error disconnecting db service for campaign {campaign_id}: {e}")
-            
-            # Disconnect redis service
-            redis_service = self.controller_redis_services.pop(campaign_id, None)
-            if redis_service:
-                try:
-                    await redis_service.close()
-                except Exception as e:
-                    logger.warning(f"Error disconnecting redis service for campaign {campaign_id}: {e}")
-            
-            # Thread is daemon; remove reference
-            self.controller_threads.pop(campaign_id, None)
+            self.active_tasks.pop(campaign_id, None)
             self.processed_campaigns.discard(campaign_id)
             
     def get_status(self) -> Dict[str, any]:
@@ -361,50 +348,3 @@ class SchedulerController:
                 "max_concurrent_campaigns": self.config.MAX_CONCURRENT_CAMPAIGNS
             }
         }
-
-    def _run_controller_thread(self, campaign_id: str):
-        """Thread entry: create loop, connect DB, run controller until completion, then disconnect."""
-        controller = self.active_controllers.get(campaign_id)
-        if controller is None:
-            return
-        loop = asyncio.new_event_loop()
-        self.controller_loops[campaign_id] = loop
-        try:
-            asyncio.set_event_loop(loop)
-            db = self.controller_db_services.get(campaign_id)
-            if db is None:
-                return
-            # KẾT NỐI DB
-            loop.run_until_complete(db.connect())
-
-            # KẾT NỐI REDIS (trong thread này) VÀ GẮN VÀO CONTROLLER
-            redis_svc = self.controller_redis_services.get(campaign_id)
-            if redis_svc is None:
-                logger.error(f"No Redis service found for campaign {campaign_id}")
-                return
-                
-            loop.run_until_complete(redis_svc.connect())
-            controller.attach_redis(redis_svc)
-
-            # CHẠY CONTROLLER
-            loop.run_until_complete(controller.start())
-        except Exception as e:
-            logger.error(f"Controller thread crashed for campaign {campaign_id}: {e}")
-        finally:
-            try:
-                db = self.controller_db_services.get(campaign_id)
-                if db is not None:
-                    loop.run_until_complete(db.disconnect())
-                
-                redis_svc = self.controller_redis_services.get(campaign_id)
-                if redis_svc is not None:
-                    loop.run_until_complete(redis_svc.close())
-                    
-            except Exception as e:
-                logger.warning(f"Error cleaning up resources for campaign {campaign_id}: {e}")
-            finally:
-                try:
-                    loop.stop()
-                except Exception:
-                    pass
-                loop.close()
@@ -11,17 +11,28 @@ r = redis.Redis(
 pattern = "call*"
 cursor = 0
 total_deleted = 0
+# Số lượt SCAN gom vào một pipeline UNLINK trước khi gửi
+BATCHES_PER_FLUSH = 10
 
 print(f"Đang quét và xóa tất cả key khớp mẫu: {pattern}")
 
+# UNLINK: Redis giải phóng bộ nhớ ở background thay vì block như DEL
+pipe = r.pipeline(transaction=False)
+pending = 0
+
 while True:
-    cursor, keys = r.scan(cursor=cursor, match=pattern, count=100)
+    cursor, keys = r.scan(cursor=cursor, match=pattern, count=1000)
     if keys:
-        deleted = r.delete(*keys)
+        pipe.unlink(*keys)
+        pending += 1
+
+    if pending and (pending >= BATCHES_PER_FLUSH or cursor == 0):
+        deleted = sum(pipe.execute())
         total_deleted += deleted
-        print(f"Đã xóa {deleted} key: {keys}")
+        print(f"Đã xóa {deleted} key")
+        pending = 0
 
     if cursor == 0:
         break
 
-print(f"\n✅ Tổng cộng đã xóa {total_deleted} key.")
\ No newline at end of file
+print(f"\n✅ Tổng cộng đã xóa {total_deleted} key.")
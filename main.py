@@ -1,10 +1,16 @@
 import asyncio
 import logging
+import random
 import signal
 import sys
 from datetime import datetime
 
-from models.config import Config
+try:
+    import uvloop
+except ImportError:  # uvloop không hỗ trợ Windows
+    uvloop = None
+
+from models.config import get_config
 from controllers.scheduler_controller import SchedulerController
 from views.scheduler_view import SchedulerView
 
@@ -18,7 +24,7 @@ class SchedulerServer:
     """Main server"""
     
     def __init__(self):
-        self.config = Config()
+        self.config = get_config()
         self.scheduler_controller = SchedulerController(self.config)
         self.scheduler_view = SchedulerView(self.scheduler_controller)
         
@@ -36,18 +42,21 @@ class SchedulerServer:
         # Initialize controller
         await self.scheduler_controller.initialize()
         
-        logger.info(f"🚀 Scheduler started - checking every {self.config.CHECK_INTERVAL} seconds")
+        logger.info(f"🚀 Scheduler started - checking every {min(self.config.CHECK_INTERVAL_MIN, self.config.CHECK_INTERVAL)}-{self.config.CHECK_INTERVAL} seconds")
         logger.info(f"📊 Max concurrent campaigns: {self.config.MAX_CONCURRENT_CAMPAIGNS}")
         
         # Main loop
         cycle_count = 0
+        # CHECK_INTERVAL_MIN cấu hình lớn hơn CHECK_INTERVAL thì vẫn không vượt quá CHECK_INTERVAL
+        min_interval = min(self.config.CHECK_INTERVAL_MIN, self.config.CHECK_INTERVAL)
+        interval = min_interval
         while self.running:
             try:
                 cycle_count += 1
                 self.scheduler_view.display_cycle_start(cycle_count)
                 
                 # Run scheduler cycle
-                await self.scheduler_controller.run_cycle()
+                did_work = await self.scheduler_controller.run_cycle()
                 
                 # Display cycle statistics
                 status = self.scheduler_controller.get_status()
@@ -60,7 +69,12 @@ class SchedulerServer:
                 ]
                 self.scheduler_view.display_controller_status(controller_stats)
                 
-                await asyncio.sleep(self.config.CHECK_INTERVAL)
+                # Có thay đổi -> chu kỳ sau chạy sớm; rảnh -> giãn dần tới CHECK_INTERVAL
+                if did_work:
+                    interval = min_interval
+                else:
+                    interval = min(interval * 2, self.config.CHECK_INTERVAL)
+                await asyncio.sleep(interval + random.uniform(0, 0.5))
                 
             except Exception as e:
                 self.scheduler_view.display_error(str(e), "Main loop")
@@ -81,7 +95,11 @@ def main():
     server = SchedulerServer()
     
     try:
-        asyncio.run(server.start())
+        # Dùng event loop của uvloop nếu có (nhanh hơn cho I/O Redis/Postgres)
+        if uvloop is not None:
+            uvloop.run(server.start())
+        else:
+            asyncio.run(server.start())
     except KeyboardInterrupt:
         logger.info("Shutdown initiated by user")
     except Exception as e:
@@ -1,6 +1,7 @@
 # Models package
 from .campaign import Campaign
 from .lead import Lead
-from .config import Config
+from .config import Config, get_config
+from .call_callback import CallCallback
 
-__all__ = ['Campaign', 'Lead', 'Config']
+__all__ = ['Campaign', 'Lead', 'Config', 'get_config', 'CallCallback']
@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+@dataclass(slots=True, frozen=True)
+class CallCallback:
+    """Callback kết quả cuộc gọi từ Call Agent (queue call_callbacks)."""
+    call_id: str
+    status: Optional[str]
+    campaign_id: str
+    lead_id: Optional[str]
+    phone: str = ""
+    attempt: int = 0
+    max_attempts: int = 3
+    retry_interval: int = 300
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CallCallback":
+        """Tạo từ JSON callback (camelCase), ép kiểu các field một lần.
+        Raise ValueError nếu thiếu callId / campaignId; thiếu leadId thì lead_id = None
+        (vẫn xử lý phone và in-progress).
+        """
+        get = data.get
+        call_id, campaign_id, lead_id = get("callId"), get("campaignId"), get("leadId")
+        if not call_id or not campaign_id:
+            raise ValueError("missing callId/campaignId")
+        return cls(
+            call_id=str(call_id),
+            status=get("status"),
+            campaign_id=str(campaign_id),
+            lead_id=str(lead_id) if lead_id else None,
+            phone=str(get("leadPhoneNumber", "")),
+            attempt=int(get("attempt", 0)),
+            max_attempts=int(get("maxAttempts", 3)),
+            retry_interval=int(get("retryInterval", 300)),
+        )
@@ -1,8 +1,77 @@
-from dataclasses import dataclass
+import logging
+from dataclasses import dataclass, field
 from datetime import datetime, timezone, timedelta
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 
-@dataclass
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Múi giờ UTC+7 (tạo một lần, dùng chung)
+TZ_UTC7 = timezone(timedelta(hours=7))
+
+# Các khoảng [start, end) theo phút trong ngày; None = không giới hạn khung giờ
+TimeWindows = Optional[Tuple[Tuple[int, int], ...]]
+
+# time_of_day (chuỗi JSON) -> TimeWindows; Campaign được dựng lại mỗi lần đọc DB nên cache theo chuỗi
+TIME_WINDOWS_CACHE_MAX = 1024
+_time_windows_cache: Dict[str, TimeWindows] = {}
+
+def _parse_time_windows(time_of_day_field: Any) -> TimeWindows:
+    """Parse time_of_day JSON thành các khoảng phút đã sắp xếp, gộp chồng lấn. Tolerant to bad data.
+
+    time_of_day format: [{"fromHour":8,"fromMinute":8,"toHour":8,"toMinute":8}]
+    - Không có cấu hình hoặc cấu hình rỗng/không hợp lệ -> None (cho phép mọi lúc)
+    - Khoảng rỗng hoặc ngược (start >= end) bị bỏ qua
+    """
+    cacheable = isinstance(time_of_day_field, str)
+    if cacheable:
+        cached = _time_windows_cache.get(time_of_day_field, False)
+        if cached is not False:
+            return cached
+
+    windows = []
+    try:
+        if time_of_day_field:
+            if cacheable:
+                time_of_day = orjson.loads(time_of_day_field)
+            else:
+                time_of_day = time_of_day_field
+            if isinstance(time_of_day, list):
+                for item in time_of_day:
+                    if not isinstance(item, dict):
+                        continue
+                    fh = max(0, min(23, int(item.get("fromHour", 0))))
+                    fm = max(0, min(59, int(item.get("fromMinute", 0))))
+                    th = max(0, min(23, int(item.get("toHour", 23))))
+                    tm = max(0, min(59, int(item.get("toMinute", 59))))
+                    windows.append((fh * 60 + fm, th * 60 + tm))
+    except Exception:
+        logger.warning("Invalid time_of_day format; ignoring windows")
+        windows = []
+
+    if not windows:
+        intervals = None
+    else:
+        merged = []
+        for start, end in sorted(windows):
+            if start >= end:
+                continue
+            # Gộp các khoảng chồng lấn/nối tiếp -> ít phép so sánh hơn
+            if merged and start <= merged[-1][1]:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        intervals = tuple(merged)
+
+    if cacheable:
+        if len(_time_windows_cache) >= TIME_WINDOWS_CACHE_MAX:
+            _time_windows_cache.clear()
+        _time_windows_cache[time_of_day_field] = intervals
+    return intervals
+
+@dataclass(slots=True, frozen=True)
 class Campaign:
     id: str
     tenant_id: str
@@ -19,19 +88,21 @@ class Campaign:
     time_of_day: Optional[str] = None
     max_callback: Optional[int] = None
     callback_conditions: Optional[str] = None
+    # Khung giờ đã parse từ time_of_day (tính một lần khi tạo)
+    time_windows: TimeWindows = field(init=False, default=None, repr=False, compare=False)
+    
+    def __post_init__(self):
+        object.__setattr__(self, "time_windows", _parse_time_windows(self.time_of_day))
     
-    def is_time_valid(self) -> bool:
-        """Kiểm tra thời gian campaign có hợp lệ không (xử lý timezone UTC+7)."""
-        def to_utc7_aware(dt: Optional[datetime]) -> Optional[datetime]:
-            if dt is None:
-                return None
-            if dt.tzinfo is None:
-                return dt.replace(tzinfo=timezone(timedelta(hours=7)))
-            return dt.astimezone(timezone(timedelta(hours=7)))
-        now_utc7 = datetime.now(timezone(timedelta(hours=7)))
-        start_utc7 = to_utc7_aware(self.start_time)
-        end_utc7 = to_utc7_aware(self.end_time)
-
-        start_ok = (start_utc7 is None) or (start_utc7 <= now_utc7)
-        end_ok = (end_utc7 is None) or (end_utc7 > now_utc7)
-        return start_ok and end_ok
+    def is_time_valid(self, now: Optional[datetime] = None) -> bool:
+        """Kiểm tra thời gian campaign có hợp lệ không (xử lý timezone UTC+7).
+
+        now: thời điểm aware dùng chung cho cả lượt lọc (mặc định datetime.now(TZ_UTC7)).
+        start_time/end_time không có tzinfo được hiểu là giờ UTC+7.
+        """
+        if now is None:
+            now = datetime.now(TZ_UTC7)
+        s = self.start_time
+        e = self.end_time
+        return ((s is None or (s if s.tzinfo else s.replace(tzinfo=TZ_UTC7)) <= now)
+                and (e is None or (e if e.tzinfo else e.replace(tzinfo=TZ_UTC7)) > now))
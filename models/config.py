@@ -1,36 +1,84 @@
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-@dataclass
+def _build_db_url() -> str:
+    # Ưu tiên DATABASE_URL nếu có
+    db_url = os.getenv("DATABASE_URL")
+    if db_url:
+        return db_url
+    # Hỗ trợ tự dựng từ POSTGRES_*
+    host = os.getenv("POSTGRES_HOST")
+    if host:
+        user = os.getenv("POSTGRES_USER", "postgres")
+        password = os.getenv("POSTGRES_PASSWORD", "")
+        db = os.getenv("POSTGRES_DB", "postgres")
+        port = os.getenv("POSTGRES_PORT", "5432")
+        return f"postgresql://{user}:{password}@{host}:{port}/{db}"
+    # Mặc định local
+    return ""
+
+def _env_str(name: str, default: str):
+    return field(default_factory=lambda: os.getenv(name, default))
+
+def _env_int(name: str, default: str):
+    return field(default_factory=lambda: int(os.getenv(name, default)))
+
+def _env_float(name: str, default: str):
+    return field(default_factory=lambda: float(os.getenv(name, default)))
+
+def _env_bool(name: str, default: str):
+    return field(default_factory=lambda: os.getenv(name, default).strip().lower() in ("1", "true", "yes"))
+
+@dataclass(frozen=True, slots=True)
 class Config:
+    """Cấu hình đọc từ biến môi trường lúc khởi tạo; dùng get_config() để lấy instance dùng chung"""
     # Database config
-    def _build_db_url() -> str:
-        # Ưu tiên DATABASE_URL nếu có
-        db_url = os.getenv("DATABASE_URL")
-        if db_url:
-            return db_url
-        # Hỗ trợ tự dựng từ POSTGRES_*
-        host = os.getenv("POSTGRES_HOST")
-        if host:
-            user = os.getenv("POSTGRES_USER", "postgres")
-            password = os.getenv("POSTGRES_PASSWORD", "")
-            db = os.getenv("POSTGRES_DB", "postgres")
-            port = os.getenv("POSTGRES_PORT", "5432")
-            return f"postgresql://{user}:{password}@{host}:{port}/{db}"
-        # Mặc định local
-        return ""
-
-    DATABASE_URL: str = _build_db_url()
+    DATABASE_URL: str = field(default_factory=_build_db_url)
+    # Pool asyncpg duy nhất dùng chung cho scheduler và mọi campaign controller
+    DB_POOL_MIN_SIZE: int = _env_int("DB_POOL_MIN_SIZE", "2")
+    DB_POOL_MAX_SIZE: int = _env_int("DB_POOL_MAX_SIZE", "10")
+    # Cache danh sách campaigns của scheduler; bị xoá sớm khi nhận NOTIFY trên CAMPAIGN_NOTIFY_CHANNEL.
+    # Mặc định tắt: chỉ bật khi DB đã có trigger NOTIFY, nếu không thay đổi campaign trễ tới hết TTL:
+    #   CREATE FUNCTION notify_campaigns_changed() RETURNS trigger AS $$
+    #   BEGIN PERFORM pg_notify('campaigns_changed', ''); RETURN NULL; END $$ LANGUAGE plpgsql;
+    #   CREATE TRIGGER campaigns_changed AFTER INSERT OR UPDATE OR DELETE ON public.campaigns
+    #   FOR EACH STATEMENT EXECUTE FUNCTION notify_campaigns_changed();
+    CAMPAIGN_CACHE_TTL: float = _env_float("CAMPAIGN_CACHE_TTL", "0")  # seconds, 0 = tắt
+    CAMPAIGN_NOTIFY_CHANNEL: str = _env_str("CAMPAIGN_NOTIFY_CHANNEL", "campaigns_changed")
     
     # Scheduler config
-    CHECK_INTERVAL: int = int(os.getenv("CHECK_INTERVAL", "60"))  # seconds
-    MAX_CONCURRENT_CAMPAIGNS: int = int(os.getenv("MAX_CONCURRENT_CAMPAIGNS", "10"))
+    # Chu kỳ scheduler: về CHECK_INTERVAL_MIN khi chu kỳ có thay đổi, nhân đôi dần tới CHECK_INTERVAL khi rảnh
+    CHECK_INTERVAL: int = _env_int("CHECK_INTERVAL", "60")  # seconds
+    CHECK_INTERVAL_MIN: int = _env_int("CHECK_INTERVAL_MIN", "5")  # seconds
+    MAX_CONCURRENT_CAMPAIGNS: int = _env_int("MAX_CONCURRENT_CAMPAIGNS", "10")
+    # Backoff (full jitter) khi campaign không có lead để gọi: base IDLE_MIN_S, trần IDLE_MAX_S
+    IDLE_MIN_S: float = _env_float("IDLE_MIN_S", "0.1")  # seconds
+    IDLE_MAX_S: float = _env_float("IDLE_MAX_S", "5")  # seconds
+    # Backoff (equal jitter) khi vòng xử lý campaign bị lỗi
+    ERROR_BACKOFF_MIN_S: float = _env_float("ERROR_BACKOFF_MIN_S", "1")  # seconds
+    ERROR_BACKOFF_MAX_S: float = _env_float("ERROR_BACKOFF_MAX_S", "60")  # seconds
     
     # Retry config
-    DEFAULT_RETRY_INTERVAL: int = int(os.getenv("DEFAULT_RETRY_INTERVAL", "300"))  # 5 minutes
-    MAX_RETRY_ATTEMPTS: int = int(os.getenv("MAX_RETRY_ATTEMPTS", "3"))
-    REDIS_URL: str = os.getenv("REDIS_URL", "")
\ No newline at end of file
+    DEFAULT_RETRY_INTERVAL: int = _env_int("DEFAULT_RETRY_INTERVAL", "300")  # 5 minutes
+    MAX_RETRY_ATTEMPTS: int = _env_int("MAX_RETRY_ATTEMPTS", "3")
+    REDIS_URL: str = _env_str("REDIS_URL", "")
+    # Pool Redis dùng chung cho scheduler + mọi campaign controller
+    # (callback listener và wake listener nếu bật, mỗi cái giữ cố định 1 connection)
+    REDIS_MAX_CONNECTIONS: int = _env_int("REDIS_MAX_CONNECTIONS", "64")
+    # Lắng nghe camp:{id}:wake (pub/sub) để đánh thức controller khi có lead mới;
+    # chỉ bật khi service nạp lead có gọi RedisService.publish_wake
+    WAKE_PUBSUB_ENABLED: bool = _env_bool("WAKE_PUBSUB_ENABLED", "0")
+    # Giao thức Redis: 3 = RESP3 (mặc định), 2 = RESP2 cho server/proxy chưa hỗ trợ HELLO
+    REDIS_PROTOCOL: int = _env_int("REDIS_PROTOCOL", "3")
+    # Marker in-progress của lead/phone tự hết hạn sau khoảng này nếu không nhận được callback
+    INPROGRESS_TTL: int = _env_int("INPROGRESS_TTL", "900")  # seconds
+
+@lru_cache(maxsize=1)
+def get_config() -> Config:
+    """Config dùng chung (đọc biến môi trường một lần)"""
+    return Config()
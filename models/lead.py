@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from typing import Optional
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Lead:
     """Bảng public.customers."""
     id: str
@@ -10,5 +10,19 @@ class Lead:
     tenant_id: Optional[str] = None
     campaign_id: Optional[str] = None
     
+    @classmethod
+    def from_pg(cls, row) -> "Lead":
+        """asyncpg Record của SELECT id, phone_number, name, tenant_id, campaign_id -> Lead.
+        Đọc theo vị trí cột, chỉ str() các giá trị chưa phải chuỗi (uuid, ...).
+        """
+        lead_id, phone, name, tenant_id, campaign_id = row
+        return cls(
+            lead_id if type(lead_id) is str else str(lead_id),
+            phone if type(phone) is str else str(phone),
+            name,
+            str(tenant_id) if tenant_id is not None else None,
+            str(campaign_id) if campaign_id is not None else None,
+        )
+    
     def get_display_name(self) -> str:
         return self.name or f"Lead {self.phone_number}"
@@ -1,89 +1,166 @@
 import asyncpg
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 from models.campaign import Campaign
 from models.lead import Lead
 
 logger = logging.getLogger(__name__)
 
+def _campaign_from_row(row) -> Campaign:
+    """Dòng SELECT _CAMPAIGN_COLUMNS -> Campaign, dựng theo vị trí (thứ tự cột trùng thứ tự field của Campaign)"""
+    return Campaign(*row)
+
 class DatabaseService:
     """Service layer cho database operations"""
     
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, min_size: int = 2, max_size: int = 10,
+                 campaign_cache_ttl: float = 0, notify_channel: Optional[str] = None):
         self.database_url = database_url
+        self.min_size = min_size
+        self.max_size = max_size
         self.pool = None
+        # Cache danh sách campaigns theo key của query: key -> (monotonic lúc lấy, campaigns)
+        # campaign_cache_ttl <= 0 -> không cache
+        self.campaign_cache_ttl = campaign_cache_ttl
+        self._campaign_cache: Dict[Tuple[str, ...], Tuple[float, List[Campaign]]] = {}
+        # Tăng mỗi lần invalidate: query đang chạy dở khi có NOTIFY thì không ghi kết quả cũ vào cache
+        self._campaign_cache_gen = 0
+        # Kênh LISTEN: trigger trên public.campaigns NOTIFY vào kênh này khi INSERT/UPDATE/DELETE
+        # -> xoá cache ngay, không phải chờ hết TTL
+        self.notify_channel = notify_channel
+        self._listen_conn = None
         
     async def connect(self):
         """Kết nối database"""
-        self.pool = await asyncpg.create_pool(self.database_url)
+        # timezone UTC+7: so sánh start_time/end_time (timestamp không timezone) với now() trong SQL
+        self.pool = await asyncpg.create_pool(
+            self.database_url, min_size=self.min_size, max_size=self.max_size,
+            server_settings={"timezone": "Asia/Ho_Chi_Minh"},
+        )
         logger.info("Connected to database")
+        if self.notify_channel and self.campaign_cache_ttl > 0:
+            try:
+                # Connection riêng cho LISTEN, không chiếm connection của pool
+                self._listen_conn = await asyncpg.connect(self.database_url)
+                await self._listen_conn.add_listener(self.notify_channel, self._on_campaigns_changed)
+                logger.info(f"Listening for campaign changes on '{self.notify_channel}'")
+            except Exception as e:
+                logger.warning(f"LISTEN {self.notify_channel} failed, campaign cache relies on TTL only: {e}")
+                self._listen_conn = None
+        
+    def _on_campaigns_changed(self, connection, pid, channel, payload):
+        """Callback NOTIFY: bỏ cache danh sách campaigns"""
+        self.invalidate_campaign_cache()
+        
+    def invalidate_campaign_cache(self):
+        """Xoá cache danh sách campaigns (lần đọc sau sẽ query lại)"""
+        self._campaign_cache_gen += 1
+        self._campaign_cache.clear()
         
     async def disconnect(self):
         """Ngắt kết nối database"""
+        if self._listen_conn is not None:
+            try:
+                await self._listen_conn.close()
+            except Exception as e:
+                logger.warning(f"Error closing LISTEN connection: {e}")
+            self._listen_conn = None
         if self.pool:
             await self.pool.close()
             logger.info("Disconnected from database")
             
-    async def get_running_campaigns(self) -> List[Campaign]:
-        """Lấy danh sách campaigns có status running"""
-        query = """
-        SELECT c.id, c.tenant_id, c.name, c.status, c.start_time, c.end_time, c.script_id, c.call_interval,
-               c.description, c.voice_id, c.email, c.max_call_time, c.time_of_day, c.max_callback, c.callback_conditions
-        FROM public.campaigns c
-        WHERE c.status = 'running'
+    # Giữ đúng thứ tự field của Campaign (xem _campaign_from_row)
+    _CAMPAIGN_COLUMNS = """
+        c.id, c.tenant_id, c.name, c.status, c.start_time, c.end_time, c.script_id, c.call_interval,
+        c.description, c.voice_id, c.email, c.max_call_time, c.time_of_day, c.max_callback, c.callback_conditions
+    """
+    
+    async def _fetch_campaigns_cached(self, key: Tuple, query: str, *args) -> List[Campaign]:
+        """Chạy query campaigns, cache kết quả campaign_cache_ttl giây (hoặc tới khi có NOTIFY).
+        Không sửa list trả về (dùng chung giữa các lần gọi).
         """
+        if self.campaign_cache_ttl > 0:
+            cached = self._campaign_cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.campaign_cache_ttl:
+                return cached[1]
         
+        gen = self._campaign_cache_gen
+        fetched_at = time.monotonic()
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(query)
+            rows = await conn.fetch(query, *args)
             
-        return [Campaign(**dict(row)) for row in rows]
+        campaigns = [_campaign_from_row(row) for row in rows]
+        if self.campaign_cache_ttl > 0 and gen == self._campaign_cache_gen:
+            self._campaign_cache[key] = (fetched_at, campaigns)
+        return campaigns
     
-    async def get_stopped_campaigns(self) -> List[Campaign]:
-        """Lấy danh sách campaigns đã dừng hoặc tạm dừng"""
-        query = """
-        SELECT c.id, c.tenant_id, c.name, c.status, c.start_time, c.end_time, c.script_id, c.call_interval,
-               c.description, c.voice_id, c.email, c.max_call_time, c.time_of_day, c.max_callback, c.callback_conditions
+    async def get_scheduler_campaigns(self) -> List[Campaign]:
+        """Campaigns cho một chu kỳ scheduler: running đang trong khoảng start_time/end_time + paused/ended.
+        Khoảng start/end lọc ngay trong SQL (session timezone UTC+7, giống cách Campaign.is_time_valid hiểu
+        timestamp không có timezone).
+        """
+        query = f"""
+        SELECT {self._CAMPAIGN_COLUMNS}
         FROM public.campaigns c
         WHERE c.status IN ('paused', 'ended')
+           OR (c.status = 'running'
+               AND (c.start_time IS NULL OR c.start_time <= now())
+               AND (c.end_time IS NULL OR c.end_time > now()))
         """
+        return await self._fetch_campaigns_cached(("__cycle__",), query)
+    
+    async def get_pending_leads_for_campaign(self, campaign_id: str, limit: int = 50,
+                                             after: Optional[str] = None) -> List[Lead]:
+        """Lấy tối đa `limit` leads chưa được gọi cho campaign (thứ tự ổn định theo created_at, id).
+
+        after: id của lead cuối trang trước -> lấy trang kế tiếp theo keyset (created_at, id),
+        không quét lại các dòng đầu (CampaignController giữ vị trí này giữa các lượt). Cần index:
+        CREATE INDEX idx_customers_campaign_created ON public.customers (campaign_id, created_at, id);
+        """
+        if after is None:
+            query = """
+            SELECT c.id, c.phone_number, c.name, c.tenant_id, c.campaign_id
+            FROM public.customers c
+            WHERE c.campaign_id = $1
+            ORDER BY c.created_at, c.id
+            LIMIT $2
+            """
+            args = (campaign_id, limit)
+        else:
+            query = """
+            SELECT c.id, c.phone_number, c.name, c.tenant_id, c.campaign_id
+            FROM public.customers c
+            WHERE c.campaign_id = $1
+              AND (c.created_at, c.id) > (SELECT p.created_at, p.id FROM public.customers p WHERE p.id = $3)
+            ORDER BY c.created_at, c.id
+            LIMIT $2
+            """
+            args = (campaign_id, limit, after)
         
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(query)
-            
-        return [Campaign(**dict(row)) for row in rows]
+            rows = await conn.fetch(query, *args)
+        return [Lead.from_pg(row) for row in rows]
     
-    async def get_pending_leads_for_campaign(self, campaign_id: str) -> List[Lead]:
-        """Lấy danh sách leads chưa được gọi cho campaign"""
+    async def get_campaign_ids_with_pending_leads(self, campaign_ids: List) -> Set:
+        """Trong các campaign_ids, trả về tập id của campaign còn lead cần gọi (một query cho cả danh sách)"""
+        if not campaign_ids:
+            return set()
         query = """
-        SELECT c.id, c.phone_number, c.name, c.tenant_id, c.campaign_id
-        FROM public.customers c
-        WHERE c.campaign_id = $1
-        ORDER BY c.created_at
-        LIMIT 50
+        SELECT c.id
+        FROM public.campaigns c
+        WHERE c.id = ANY($1)
+          AND EXISTS (SELECT 1 FROM public.customers cu WHERE cu.campaign_id = c.id)
         """
-        
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(query, campaign_id)
-        leads: List[Lead] = []
-        for row in rows:
-            data = dict(row)
-            leads.append(
-                Lead(
-                    id=str(data.get("id")),
-                    phone_number=str(data.get("phone_number")),
-                    name=data.get("name"),
-                    tenant_id=str(data.get("tenant_id")) if data.get("tenant_id") is not None else None,
-                    campaign_id=str(data.get("campaign_id")) if data.get("campaign_id") is not None else None,
-                )
-            )
-        return leads
+            rows = await conn.fetch(query, list(campaign_ids))
+        return {row["id"] for row in rows}
     
     async def get_campaign_by_id(self, campaign_id: str) -> Optional[Campaign]:
         """Lấy thông tin campaign theo id"""
-        query = """
-        SELECT c.id, c.tenant_id, c.name, c.status, c.start_time, c.end_time, c.script_id, c.call_interval,
-               c.description, c.voice_id, c.email, c.max_call_time, c.time_of_day, c.max_callback, c.callback_conditions
+        query = f"""
+        SELECT {self._CAMPAIGN_COLUMNS}
         FROM public.campaigns c
         WHERE c.id = $1
         """
@@ -91,4 +168,4 @@ class DatabaseService:
             row = await conn.fetchrow(query, campaign_id)
         if row is None:
             return None
-        return Campaign(**dict(row))
\ No newline at end of file
+        return _campaign_from_row(row)
\ No newline at end of file
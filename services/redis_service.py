@@ -1,23 +1,72 @@
 # redis_service.py (file mới)
-import time, json
+import asyncio
+import time
 import logging
-from typing import Optional, Dict, Any, List
+import orjson
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
 import redis.asyncio as redis
+from redis.exceptions import ResponseError
 
 logger = logging.getLogger(__name__)
 
+# Kiểu redis-py encode trực tiếp (bool không nằm đây: redis-py từ chối bool)
+_HSET_SCALARS = (str, bytes, int, float)
+
+def _encode_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Chuyển payload retry thành mapping cho HSET (dict/list -> JSON; str/bytes/int/float giữ nguyên
+    để redis-py tự encode; None -> bỏ field; còn lại -> str)"""
+    return {
+        k: v if type(v) in _HSET_SCALARS else orjson.dumps(v) if isinstance(v, (dict, list)) else str(v)
+        for k, v in payload.items() if v is not None
+    }
+
+def _maybe_json(v: str):
+    """Giải mã giá trị hash do _encode_payload ghi: chỉ dict/list được ghi dạng JSON,
+    nên chỉ thử parse khi bắt đầu bằng '{' / '['; còn lại giữ nguyên chuỗi (không raise/catch cho mỗi field)"""
+    if v[:1] in ("{", "["):
+        try: return orjson.loads(v)
+        except orjson.JSONDecodeError: return v
+    return v
+
 class RedisService:
     """
     - call:{call_id}      -> HASH   (metadata cuộc gọi)
     - camp:{cid}:retry    -> ZSET   (các call_id cần retry, score = epoch khi đến hạn)
     - camp:{cid}:done     -> SET    (lead_id đã thành công -> bỏ qua)
+    - camp:{cid}:inprog:lead:{lead_id} / camp:{cid}:inprog:phone:{phone}
+                          -> STRING (đang chờ kết quả cuộc gọi, tự hết hạn sau inprogress_ttl)
+    - camp:{cid}:wake     -> CHANNEL (pub/sub: có lead mới, đánh thức controller đang chờ)
     """
-    def __init__(self, redis_url: str):
+    def __init__(self, redis_url: str, max_connections: int = 64, inprogress_ttl: int = 900, protocol: int = 3):
         self._url = redis_url
+        self._max_connections = max_connections
+        self._protocol = protocol
+        self._inprogress_ttl = inprogress_ttl
         self._r: Optional[redis.Redis] = None
+        self._claim_due_script = None
+        self._try_claim_lead_script = None
+        # BLMPOP cần Redis >= 7; tự chuyển sang BRPOP nếu server không hỗ trợ
+        self._use_blmpop = True
 
     async def connect(self):
-        self._r = redis.from_url(self._url, decode_responses=True)
+        # Pool có giới hạn: các coroutine dùng chung, chờ khi hết connection thay vì mở thêm
+        # RESP3: reply gọn hơn, parse nhanh hơn (cần Redis >= 6; SMISMEMBER đã cần 6.2)
+        # keepalive + health check: phát hiện connection chết sau thời gian rảnh dài
+        pool = redis.BlockingConnectionPool.from_url(
+            self._url, max_connections=self._max_connections, decode_responses=True,
+            protocol=self._protocol, socket_keepalive=True, health_check_interval=30,
+        )
+        # from_pool: client sở hữu pool, aclose() sẽ đóng luôn pool
+        self._r = redis.Redis.from_pool(pool)
+        # register_script -> EVALSHA, tự SCRIPT LOAD lại khi gặp NOSCRIPT
+        self._claim_due_script = self._r.register_script(self._CLAIM_DUE_LUA)
+        self._try_claim_lead_script = self._r.register_script(self._TRY_CLAIM_LEAD_LUA)
+        # Mở sẵn connection (handshake/AUTH/HELLO) và nạp script song song: chu kỳ đầu không phải chờ,
+        # EVALSHA đầu tiên không gặp NOSCRIPT. Redis không kết nối được -> lỗi ngay khi khởi động
+        await asyncio.gather(
+            self._r.ping(),
+            *(self._r.script_load(lua) for lua in (self._CLAIM_DUE_LUA, self._TRY_CLAIM_LEAD_LUA)),
+        )
 
     async def close(self):
         if self._r:
@@ -32,47 +81,58 @@ class RedisService:
         assert self._r is not None
         return bool(await self._r.sismember(f"camp:{campaign_id}:done", str(lead_id)))
 
-    async def save_failure_and_schedule_retry(
+    async def save_success_and_finalize(self, call_id: str):
+        assert self._r is not None
+        await self._r.delete(f"call:{call_id}")
+
+    async def apply_callback_results(
         self,
-        campaign_id: str,
-        call_id: str,
-        payload: Dict[str, Any],    # {lead_id, phone, attempt, max_attempts, retry_interval_s, ...}
-        delay_seconds: int,
+        successes: List[Tuple[str, str, str, str]],          # (campaign_id, call_id, lead_id, phone)
+        retries: List[Tuple[str, str, Dict[str, Any], int]],  # (campaign_id, call_id, payload, delay_seconds)
+        finished: List[Tuple[str, str, str]],                 # (campaign_id, lead_id, phone)
     ):
+        """Ghi kết quả của một lô callback trong một pipeline (một round-trip):
+        SUCCESS -> done/done_phone + xoá payload + bỏ khỏi retry; thất bại -> lưu payload + lên lịch retry;
+        finished (SUCCESS / hết lượt retry) -> gỡ in-progress lead/phone.
+        Lead đang chờ retry giữ marker in-progress tới khi retry đến hạn (+ inprogress_ttl) để lượt quét
+        lead mới không gọi lại nó như attempt 0; _CLAIM_DUE_LUA đặt lại TTL khi claim retry.
+        """
         assert self._r is not None
-        hkey = f"call:{call_id}"
-        zkey = f"camp:{campaign_id}:retry"
-        retry_at = int(time.time()) + int(delay_seconds)
-
-        mapping = {}
-        for k, v in payload.items():
-            if isinstance(v, (dict, list)):
-                mapping[k] = json.dumps(v)
-            elif hasattr(v, '__str__') and not isinstance(v, (str, int, float, bool)):
-                mapping[k] = str(v)
-            else:
-                mapping[k] = str(v)
-
-        async with self._r.pipeline(transaction=True) as p:
-            await p.hset(hkey, mapping=mapping)
-            await p.zadd(zkey, {call_id: retry_at})
+        now_ts = int(time.time())
+        async with self._r.pipeline(transaction=False) as p:
+            for campaign_id, call_id, lead_id, phone in successes:
+                if lead_id:
+                    p.sadd(f"camp:{campaign_id}:done", str(lead_id))
+                p.sadd(f"camp:{campaign_id}:done_phone", str(phone))
+                p.delete(f"call:{call_id}")
+                p.zrem(f"camp:{campaign_id}:retry", call_id)
+            for campaign_id, call_id, payload, delay_seconds in retries:
+                p.hset(f"call:{call_id}", mapping=_encode_payload(payload))
+                p.zadd(f"camp:{campaign_id}:retry", {call_id: now_ts + int(delay_seconds)})
+                hold = max(int(delay_seconds), 0) + self._inprogress_ttl
+                if payload.get("lead_id"):
+                    p.set(f"camp:{campaign_id}:inprog:lead:{payload['lead_id']}", "1", ex=hold)
+                p.set(f"camp:{campaign_id}:inprog:phone:{payload['phone']}", "1", ex=hold)
+            for campaign_id, lead_id, phone in finished:
+                if lead_id:
+                    p.delete(f"camp:{campaign_id}:inprog:lead:{lead_id}")
+                p.delete(f"camp:{campaign_id}:inprog:phone:{phone}")
             await p.execute()
 
-    async def save_success_and_finalize(self, call_id: str):
-        assert self._r is not None
-        await self._r.delete(f"call:{call_id}")
-
-    async def mark_inprogress(self, campaign_id: str, lead_id: str):
+    async def mark_inprogress(self, campaign_id: str, lead_id: str) -> bool:
+        """SET NX EX: True nếu vừa đánh dấu, False nếu lead đã in-progress từ trước."""
         assert self._r is not None
-        await self._r.sadd(f"camp:{campaign_id}:inprogress", str(lead_id))
+        return bool(await self._r.set(
+            f"camp:{campaign_id}:inprog:lead:{lead_id}", "1", ex=self._inprogress_ttl, nx=True
+        ))
 
     async def clear_inprogress(self, campaign_id: str, lead_id: str):
         assert self._r is not None
-        await self._r.srem(f"camp:{campaign_id}:inprogress", str(lead_id))
+        await self._r.delete(f"camp:{campaign_id}:inprog:lead:{lead_id}")
 
     async def is_inprogress(self, campaign_id: str, lead_id: str) -> bool:
         assert self._r is not None
-        return bool(await self._r.sismember(f"camp:{campaign_id}:inprogress", str(lead_id)))
+        return bool(await self._r.exists(f"camp:{campaign_id}:inprog:lead:{lead_id}"))
 
     async def mark_phone_success(self, campaign_id: str, phone: str):
         assert self._r is not None
@@ -82,46 +142,135 @@ class RedisService:
         assert self._r is not None
         return bool(await self._r.sismember(f"camp:{campaign_id}:done_phone", str(phone)))
 
-    async def mark_phone_inprogress(self, campaign_id: str, phone: str):
+    async def mark_phone_inprogress(self, campaign_id: str, phone: str) -> bool:
         assert self._r is not None
-        await self._r.sadd(f"camp:{campaign_id}:inprog_phone", str(phone))
+        return bool(await self._r.set(
+            f"camp:{campaign_id}:inprog:phone:{phone}", "1", ex=self._inprogress_ttl, nx=True
+        ))
 
     async def clear_phone_inprogress(self, campaign_id: str, phone: str):
         assert self._r is not None
-        await self._r.srem(f"camp:{campaign_id}:inprog_phone", str(phone))
+        await self._r.delete(f"camp:{campaign_id}:inprog:phone:{phone}")
 
     async def is_phone_inprogress(self, campaign_id: str, phone: str) -> bool:
         assert self._r is not None
-        return bool(await self._r.sismember(f"camp:{campaign_id}:inprog_phone", str(phone)))
+        return bool(await self._r.exists(f"camp:{campaign_id}:inprog:phone:{phone}"))
 
-    _POP_DUE_LUA = """
-    local zkey = KEYS[1]
-    local now  = tonumber(ARGV[1])
-    local limit = tonumber(ARGV[2])
+    async def bulk_lead_state(
+        self, campaign_id: str, lead_ids: List[str], phones: List[str]
+    ) -> List[Tuple[bool, bool, bool, bool]]:
+        """Trả về (lead_done, phone_done, lead_inprogress, phone_inprogress) cho từng lead: 2 SMISMEMBER + 2 MGET trong một pipeline."""
+        assert self._r is not None
+        if not lead_ids:
+            return []
+        lead_ids = [str(x) for x in lead_ids]
+        phones = [str(x) for x in phones]
+        async with self._r.pipeline(transaction=False) as p:
+            p.smismember(f"camp:{campaign_id}:done", lead_ids)
+            p.smismember(f"camp:{campaign_id}:done_phone", phones)
+            p.mget([f"camp:{campaign_id}:inprog:lead:{x}" for x in lead_ids])
+            p.mget([f"camp:{campaign_id}:inprog:phone:{x}" for x in phones])
+            done, phone_done, inprog, phone_inprog = await p.execute()
+        return [
+            (bool(a), bool(b), c is not None, d is not None)
+            for a, b, c, d in zip(done, phone_done, inprog, phone_inprog)
+        ]
+
+    # Claim các retry đến hạn và phân loại ngay trên server:
+    # - lead/phone đã SUCCESS -> xoá payload, trả status 'lead_done'/'phone_done'
+    # - còn lại -> đánh dấu in-progress lead/phone, trả status 'ok'
+    # KEYS: retry zset, done set, done_phone set
+    # ARGV: now, limit, prefix hash call, prefix in-progress lead, prefix in-progress phone, ttl
+    # Trả về mảng phẳng {call_id, status, {field, value, ...}, ...}
+    _CLAIM_DUE_LUA = """
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+    if #ids == 0 then return {} end
+    redis.call('ZREM', KEYS[1], unpack(ids))
     local res = {}
-    for i=1,limit,1 do
-        local ids = redis.call('ZRANGEBYSCORE', zkey, '-inf', now, 'LIMIT', 0, 1)
-        if (ids == nil) or (#ids == 0) then break end
-        local id = ids[1]
-        redis.call('ZREM', zkey, id)
+    for _, id in ipairs(ids) do
+        local hkey = ARGV[3] .. id
+        local h = redis.call('HGETALL', hkey)
+        local lead, phone
+        for i = 1, #h, 2 do
+            if h[i] == 'lead_id' then lead = h[i + 1]
+            elseif h[i] == 'phone' then phone = h[i + 1] end
+        end
+        local status = 'ok'
+        if lead and redis.call('SISMEMBER', KEYS[2], lead) == 1 then
+            status = 'lead_done'
+        elseif phone and redis.call('SISMEMBER', KEYS[3], phone) == 1 then
+            status = 'phone_done'
+        end
+        if status == 'ok' then
+            if lead then redis.call('SET', ARGV[4] .. lead, '1', 'EX', ARGV[6]) end
+            if phone then redis.call('SET', ARGV[5] .. phone, '1', 'EX', ARGV[6]) end
+        else
+            redis.call('DEL', hkey)
+        end
         table.insert(res, id)
+        table.insert(res, status)
+        table.insert(res, h)
     end
     return res
     """
 
-    async def claim_due_retries(self, campaign_id: str, limit: int = 10) -> List[str]:
+    async def claim_retries_for_dispatch(
+        self, campaign_id: str, limit: int = 10
+    ) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """Claim retry đến hạn, trả về [(call_id, status, payload)].
+
+        status 'ok': lead/phone đã được đánh dấu in-progress, caller chỉ cần gửi request.
+        status 'lead_done'/'phone_done': retry đã được dọn, không cần gửi.
+        """
+        assert self._r is not None
+        keys = [
+            f"camp:{campaign_id}:retry",
+            f"camp:{campaign_id}:done",
+            f"camp:{campaign_id}:done_phone",
+        ]
+        args = [
+            int(time.time()), limit, "call:",
+            f"camp:{campaign_id}:inprog:lead:",
+            f"camp:{campaign_id}:inprog:phone:",
+            self._inprogress_ttl,
+        ]
+        res = await self._claim_due_script(keys=keys, args=args)
+        claimed = []
+        for i in range(0, len(res), 3):
+            flat = res[i + 2]
+            payload = {flat[j]: _maybe_json(flat[j + 1]) for j in range(0, len(flat), 2)}
+            claimed.append((res[i], res[i + 1], payload))
+        return claimed
+
+    # Kiểm tra + đánh dấu in-progress một lead mới một cách nguyên tử.
+    # KEYS: done set, done_phone set, in-progress lead key, in-progress phone key
+    # ARGV: lead_id, phone, ttl. Trả về 1 nếu claim được, 0 nếu lead/phone đã xong hoặc đang xử lý
+    _TRY_CLAIM_LEAD_LUA = """
+    if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then return 0 end
+    if redis.call('SISMEMBER', KEYS[2], ARGV[2]) == 1 then return 0 end
+    if redis.call('EXISTS', KEYS[3], KEYS[4]) > 0 then return 0 end
+    redis.call('SET', KEYS[3], '1', 'EX', ARGV[3])
+    redis.call('SET', KEYS[4], '1', 'EX', ARGV[3])
+    return 1
+    """
+
+    async def try_claim_lead(self, campaign_id: str, lead_id: str, phone: str) -> bool:
+        """Đánh dấu in-progress lead/phone nếu chưa SUCCESS và chưa in-progress (một round-trip)."""
         assert self._r is not None
-        zkey = f"camp:{campaign_id}:retry"
-        now_ts = int(time.time())
-        return await self._r.eval(self._POP_DUE_LUA, 1, zkey, now_ts, limit)
+        keys = [
+            f"camp:{campaign_id}:done",
+            f"camp:{campaign_id}:done_phone",
+            f"camp:{campaign_id}:inprog:lead:{lead_id}",
+            f"camp:{campaign_id}:inprog:phone:{phone}",
+        ]
+        return bool(await self._try_claim_lead_script(
+            keys=keys, args=[str(lead_id), str(phone), self._inprogress_ttl]
+        ))
 
     async def get_call_payload(self, call_id: str) -> Dict[str, Any]:
         assert self._r is not None
         data = await self._r.hgetall(f"call:{call_id}")
-        def _maybe(v: str):
-            try: return json.loads(v)
-            except Exception: return v
-        return {k: _maybe(v) for k, v in data.items()}
+        return {k: _maybe_json(v) for k, v in data.items()}
 
     async def remove_retry(self, campaign_id: str, call_id: str):
         assert self._r is not None
@@ -134,42 +283,80 @@ class RedisService:
     async def send_call_request(self, call_request: Dict[str, Any]):
         """Gửi call request cho Call Agent"""
         assert self._r is not None
-        await self._r.lpush("call_requests", json.dumps(call_request))
-        logger.info(f"Sent call request: {call_request.get('callId')}")
+        await self._r.lpush("call_requests", orjson.dumps(call_request))
+        logger.info("Sent call request: %s", call_request.get('callId'))
+
+    async def send_call_requests(self, call_requests: List[Dict[str, Any]]):
+        """Gửi nhiều call request cho Call Agent bằng một lệnh LPUSH"""
+        assert self._r is not None
+        if not call_requests:
+            return
+        await self._r.lpush("call_requests", *(orjson.dumps(r) for r in call_requests))
+        logger.info("Sent %d call requests", len(call_requests))
 
-    async def get_call_requests(self, timeout: int = 1) -> List[Dict[str, Any]]:
-        """Lấy call requests từ queue (cho Call Agent)"""
+    async def get_call_requests(self, timeout: int = 1, count: int = 10) -> List[Dict[str, Any]]:
+        """Lấy tối đa `count` call requests từ queue (cho Call Agent) trong một round-trip"""
         assert self._r is not None
         requests = []
-        for _ in range(10):  # Lấy tối đa 10 requests
-            result = await self._r.brpop("call_requests", timeout=timeout)
-            if result is None:
-                break
+        for raw in await self._pop_many("call_requests", timeout, count):
             try:
-                request = json.loads(result[1])
-                requests.append(request)
+                requests.append(orjson.loads(raw))
             except Exception as e:
-                logger.error(f"Failed to parse call request: {e}")
+                logger.error("Failed to parse call request: %s", e)
         return requests
 
+    async def _pop_many(self, key: str, timeout: int, count: int) -> List[str]:
+        """BLMPOP (Redis >= 7) lấy nhiều phần tử một lần; fallback BRPOP + RPOP count cho Redis cũ"""
+        if self._use_blmpop:
+            try:
+                result = await self._r.blmpop(timeout, 1, key, direction="RIGHT", count=count)
+                return result[1] if result else []
+            except ResponseError as e:
+                # Chỉ chuyển sang BRPOP khi server không có lệnh BLMPOP; lỗi khác (WRONGTYPE, OOM, ...) raise như cũ
+                if "unknown command" not in str(e).lower():
+                    raise
+                logger.warning("BLMPOP not supported by Redis server, falling back to BRPOP")
+                self._use_blmpop = False
+
+        result = await self._r.brpop(key, timeout=timeout)
+        if result is None:
+            return []
+        rest = await self._r.rpop(key, count - 1) if count > 1 else None
+        return [result[1]] + (rest or [])
+
     # ----- CALLBACK HANDLING -----
     async def send_call_callback(self, callback_data: Dict[str, Any]):
         """Gửi callback từ Call Agent về Scheduler"""
         assert self._r is not None
-        await self._r.lpush("call_callbacks", json.dumps(callback_data))
-        logger.info(f"Sent callback: {callback_data.get('callId')}")
+        await self._r.lpush("call_callbacks", orjson.dumps(callback_data))
+        logger.info("Sent callback: %s", callback_data.get('callId'))
 
-    async def get_call_callbacks(self, timeout: int = 1) -> List[Dict[str, Any]]:
-        """Lấy callbacks từ queue (cho Scheduler)"""
+    async def get_call_callbacks(self, timeout: int = 1, count: int = 64) -> List[Dict[str, Any]]:
+        """Lấy tối đa `count` callbacks từ queue (cho Scheduler) trong một round-trip, block tới khi có callback"""
         assert self._r is not None
+        raw_items = await self._pop_many("call_callbacks", timeout, count)
         callbacks = []
-        for _ in range(10):  # Lấy tối đa 10 callbacks
-            result = await self._r.brpop("call_callbacks", timeout=timeout)
-            if result is None:
-                break
+        for raw in raw_items:
             try:
-                callback = json.loads(result[1])
-                callbacks.append(callback)
+                callbacks.append(orjson.loads(raw))
             except Exception as e:
-                logger.error(f"Failed to parse callback: {e}")
-        return callbacks
\ No newline at end of file
+                logger.error("Failed to parse callback: %s", e)
+        return callbacks
+
+    # ----- WAKE (pub/sub) -----
+    async def publish_wake(self, campaign_id: str):
+        """Báo cho controller của campaign có lead mới (gọi từ service nạp lead)"""
+        assert self._r is not None
+        await self._r.publish(f"camp:{campaign_id}:wake", "1")
+
+    async def iter_wakes(self) -> AsyncIterator[str]:
+        """Lắng nghe camp:*:wake, yield campaign_id của mỗi thông báo"""
+        assert self._r is not None
+        pubsub = self._r.pubsub(ignore_subscribe_messages=True)
+        await pubsub.psubscribe("camp:*:wake")
+        try:
+            async for message in pubsub.listen():
+                channel = message.get("channel") or ""
+                yield channel[len("camp:"):-len(":wake")]
+        finally:
+            await pubsub.aclose()
@@ -4,7 +4,7 @@ Test script để kiểm tra logic của Scheduler Server
 import asyncio
 import logging
 from datetime import datetime, timedelta
-from models.config import Config
+from models.config import get_config
 from controllers.scheduler_controller import SchedulerController
 
 # Setup logging
@@ -17,7 +17,7 @@ async def test_scheduler_logic():
     
     try:
         # Tạo config
-        config = Config()
+        config = get_config()
         logger.info(f"Config loaded: CHECK_INTERVAL={config.CHECK_INTERVAL}s")
         
         # Tạo scheduler controller
@@ -17,21 +17,26 @@ class SchedulerView:
         
     def display_cycle_start(self, cycle_number: int):
         """Hiển thị bắt đầu chu kỳ"""
-        logger.info(f"Scheduler Cycle #{cycle_number}")
+        logger.info("Scheduler Cycle #%d", cycle_number)
         logger.info("-" * 40)
         
     def display_cycle_stats(self, stats: Dict[str, Any]):
         """Hiển thị thống kê chu kỳ"""
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        active = stats.get('active_controllers', 0)
+        processed = stats.get('processed_campaigns', 0)
+        check_interval = stats.get('config', {}).get('check_interval', 60)
         logger.info("Cycle Statistics:")
-        logger.info(f"   • Active Controllers: {stats.get('active_controllers', 0)}")
-        logger.info(f"   • Processed Campaigns: {stats.get('processed_campaigns', 0)}")
-        logger.info(f"   • Check Interval: {stats.get('config', {}).get('check_interval', 60)}s")
+        logger.info("   • Active Controllers: %s", active)
+        logger.info("   • Processed Campaigns: %s", processed)
+        logger.info("   • Check Interval: %ss", check_interval)
         
     def display_error(self, error: str, context: str = ""):
         """Hiển thị lỗi"""
-        logger.error(f"Error: {error}")
+        logger.error("Error: %s", error)
         if context:
-            logger.error(f"   • Context: {context}")
+            logger.error("   • Context: %s", context)
             
     def display_shutdown(self):
         """Hiển thị thông báo shutdown"""
@@ -39,9 +44,11 @@ class SchedulerView:
         
     def display_controller_status(self, controller_stats: list):
         """Hiển thị trạng thái các controllers"""
+        if not logger.isEnabledFor(logging.INFO):
+            return
         if controller_stats:
             logger.info("Active Controllers:")
             for stat in controller_stats:
-                logger.info(f"   • {stat['campaign_code']}: {stat['processed_leads']} leads processed")
+                logger.info("   • %s: %s leads processed", stat['campaign_code'], stat['processed_leads'])
         else:
             logger.info("No active controllers")
\ No newline at end of file